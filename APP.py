@@ -1,77 +1,190 @@
 import streamlit as st
 import pandas as pd
-import io
+import math
+import tempfile
+import glob
+import time
 from datetime import datetime
-import requests
-import re
-import concurrent.futures
+import os
+
+from auditoria import CATEGORIAS_AUDITORIA, analisar_dados, fingerprint_dados, remover_pedidos
+from configuracao import (API_CONTROLADORIA_HEADERS, API_CRM_URL, API_PEDIDO_DETALHADO_URL, CACHE_SYSEMP_MAX_ENTRADAS,
+                          CACHE_SYSEMP_PATH, CACHE_SYSEMP_TTL, SYSEMP_MAX_CONCORRENCIA_GLOBAL, SYSEMP_MAX_REQ_POR_SEGUNDO, TIPOS_POR_URL)
+from exportacao import MIME_TYPES, crm_mais_recente_por_raw, escrever, formatos_disponiveis, montar_detalhado, montar_resumo
+from ingestao import EXTENSOES_SUPORTADAS, hash_conteudo, ler_cabecalho, ler_coluna, preparar_base_pedidos
+from instrumentacao import MetricasExecucao
+from jobs_consulta import ERRO, JobConsulta, descartar_job, obter_job, registrar_job
+from sysemp_client import ConsultorCompartilhado, registros_para_dataframe
+from sysemp_cache import CacheSysemp
 
 # --- Configuração da página ---
 st.set_page_config(page_title="Consulta de Pedidos", page_icon="🔍", layout="wide")
 
-# --- Configurações de API ---
-API_PEDIDO_DETALHADO_URL = "http://209.14.71.180:3000/controladoria-pedido-detalhado"
-API_CRM_URL = "http://209.14.71.180:3000/controle-andamento-crm"
-API_CONTROLADORIA_HEADERS = {
-    'Authorization': 'Bearer engage@secure2024',
-    'Content-Type': 'application/json'
-}
+TAMANHOS_PAGINA_DETALHE = [10, 25, 50, 100]
+IDADE_MAXIMA_EXPORTACAO = 2 * 3600
+ENDPOINTS_SYSEMP = {"Sysemp-Detalhado": API_PEDIDO_DETALHADO_URL, "Sysemp-CRM": API_CRM_URL}
 
-# --- Funções de Logging ---
-def log_message(level, message):
-    if 'log_messages' not in st.session_state:
-        st.session_state.log_messages = []
-    st.session_state.log_messages.append({'level': level, 'content': message, 'time': datetime.now()})
+# --- Funções de Logging e Métricas ---
+def obter_metricas():
+    if 'metricas' not in st.session_state:
+        st.session_state.metricas = MetricasExecucao()
+    return st.session_state.metricas
+
+def log_message(level, message, metricas=None):
+    # Threads de consulta não enxergam st.session_state: recebem o objeto de métricas explicitamente.
+    (metricas or obter_metricas()).log(level, message)
 
 # --- FUNÇÕES DE API ---
-def consultar_api_sysemp(url, lista_ids, nome_api, max_workers=2):
-    if not lista_ids: return pd.DataFrame()
-    resultados = []
-    
-    def fetch_single(pedido_id, session):
-        try:
-            response = session.post(url, headers=API_CONTROLADORIA_HEADERS, json={"pedido": pedido_id}, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException:
-            return None
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        with requests.Session() as session:
-            future_to_pedido = {executor.submit(fetch_single, pedido_id, session): pedido_id for pedido_id in lista_ids}
-            for future in concurrent.futures.as_completed(future_to_pedido):
-                dados = future.result()
-                if dados: resultados.extend(dados)
-    
-    log_message('info', f"(API {nome_api}) {len(resultados)} registros recebidos de {len(lista_ids)} pedidos consultados.")
-    return pd.DataFrame(resultados)
-
-# --- Funções de Geração de Excel ---
-@st.cache_data
-def gerar_excel_resumido(df_resumo, audit_map):
-    df_export = df_resumo.copy()
-    df_export['Auditoria'] = df_export['pedido_normalizado'].map(audit_map).fillna('OK')
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_export.to_excel(writer, index=False, sheet_name='Resumo_por_Pedido')
-    return output.getvalue()
-
-@st.cache_data
-def gerar_excel_detalhado(df_consolidado, df_crm, audit_map):
-    df_export, df_crm_copy = df_consolidado.copy(), df_crm.copy()
-    df_export['Auditoria'] = df_export['pedido_normalizado'].map(audit_map).fillna('OK')
-    if not df_crm_copy.empty:
-        df_crm_copy['datahora_andamento'] = pd.to_datetime(df_crm_copy['datahora_andamento'], errors='coerce')
-        df_crm_recente = df_crm_copy.sort_values('datahora_andamento', ascending=False).drop_duplicates('pedido_raw', keep='first')
-        df_crm_recente = df_crm_recente[['pedido_raw', 'andamento_obs', 'usuario_andamento', 'datahora_andamento']].rename(columns={
-            'andamento_obs': 'Última Obs. CRM', 'usuario_andamento': 'Último Usuário CRM', 'datahora_andamento': 'Data Último And. CRM'})
-        df_export = pd.merge(df_export, df_crm_recente, on='pedido_raw', how='left')
-    for col in df_export.select_dtypes(include=['datetime64[ns]', 'datetime64[ns, UTC]']).columns:
-        df_export[col] = df_export[col].dt.strftime('%d/%m/%Y %H:%M:%S')
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df_export.to_excel(writer, index=False, sheet_name='Detalhes_Nota_a_Nota')
-    return output.getvalue()
+@st.cache_resource
+def obter_cache_sysemp():
+    return CacheSysemp(CACHE_SYSEMP_PATH, ttl_por_endpoint=CACHE_SYSEMP_TTL, max_entradas=CACHE_SYSEMP_MAX_ENTRADAS)
+
+@st.cache_resource
+def obter_consultor_sysemp():
+    # Único por processo: todas as sessões dividem o pool de conexões e os limites, e pedidos já em voo não são repetidos.
+    return ConsultorCompartilhado(max_concorrencia=SYSEMP_MAX_CONCORRENCIA_GLOBAL, max_por_segundo=SYSEMP_MAX_REQ_POR_SEGUNDO)
+
+# --- Consulta em segundo plano ---
+def obter_job_atual():
+    job_id = st.session_state.get('job_id') or st.query_params.get('job')
+    job = obter_job(job_id) if job_id else None
+    if job is not None and st.session_state.get('job_id') != job.id:
+        # Página recarregada: a sessão é nova, mas o job continua no processo.
+        st.session_state.job_id = job.id
+        st.session_state.metricas = job.metricas
+        st.session_state.total_pedidos_input = job.total_linhas
+    return job
+
+def iniciar_job(job):
+    registrar_job(job).iniciar()
+    # O job anterior da sessão (já retomado ou substituído) não é mais necessário; libera as respostas dele.
+    if st.session_state.get('job_id') not in (None, job.id):
+        descartar_job(st.session_state.job_id)
+    st.session_state.job_id = job.id
+    st.session_state.metricas = job.metricas
+    st.session_state.resultados_job = None
+    st.query_params['job'] = job.id
+
+def carregar_resultados(job):
+    resultados = job.resultados()
+    detalhado, crm = resultados["Sysemp-Detalhado"], resultados["Sysemp-CRM"]
+    with job.metricas.etapa("consolidação dos resultados"):
+        df_detalhado = registros_para_dataframe(detalhado.registros, TIPOS_POR_URL.get(detalhado.url))
+        df_crm = registros_para_dataframe(crm.registros, TIPOS_POR_URL.get(crm.url))
+    # Pedidos sem resposta do CRM não entram na classificação: ficam em "Falha na Consulta" ou aguardam o fim do job.
+    df_classificavel = remover_pedidos(df_detalhado, set(detalhado.respostas) - set(crm.respostas))
+    st.session_state.df_consolidado = df_classificavel
+    st.session_state.df_crm = df_crm
+    st.session_state.fingerprint_dados = fingerprint_dados(df_classificavel, df_crm) if not df_classificavel.empty else None
+    st.session_state.dados_carregados = not df_classificavel.empty
+
+    # Pedidos cuja consulta falhou (ou ainda não voltou) não podem ser contados como "Não Encontrados".
+    ids_com_falha = {pid: f"Sysemp-CRM: {erro}" for pid, erro in crm.ids_com_falha.items()}
+    ids_com_falha.update({pid: f"Sysemp-Detalhado: {erro}" for pid, erro in detalhado.ids_com_falha.items()})
+    st.session_state.ids_com_falha = ids_com_falha
+    pedidos_encontrados = set(df_detalhado['pedido_normalizado'].unique()) if not df_detalhado.empty else set()
+    st.session_state.ids_nao_encontrados = list(set(detalhado.respostas) - pedidos_encontrados)
+    st.session_state.resultados_job = (job.id, job.estado)
+
+def exibir_progresso(job):
+    progresso = job.progresso()
+    texto = f"Consulta {progresso['estado']}: {progresso['fracao']:.0%} em {progresso['decorrido_s']:.0f}s"
+    if progresso['eta_s'] is not None:
+        texto += f" (restam ~{progresso['eta_s']:.0f}s)"
+    st.progress(min(progresso['fracao'], 1.0), text=texto)
+    colunas = st.columns(len(progresso['por_endpoint']))
+    for coluna, (nome, andamento) in zip(colunas, progresso['por_endpoint'].items()):
+        coluna.metric(label=f"{nome}: respondidos / falhas", value=f"{andamento['respondidos']} / {andamento['falhas']}")
+
+@st.fragment(run_every=1.0)
+def painel_job_em_andamento(job):
+    # Só este trecho é reexecutado a cada segundo; o restante da página continua utilizável.
+    if not job.ativo:
+        carregar_resultados(job)
+        st.rerun()
+    exibir_progresso(job)
+    colC, colP, _ = st.columns([1, 1, 2])
+    if colC.button("⏹️ Cancelar consulta", use_container_width=True):
+        job.cancelar()
+    if colP.button("📊 Analisar resultados parciais", use_container_width=True):
+        carregar_resultados(job)
+        st.rerun()
+
+def painel_job_finalizado(job):
+    if st.session_state.get('resultados_job') != (job.id, job.estado):
+        carregar_resultados(job)
+    if job.estado == ERRO:
+        st.error(f"A consulta foi interrompida por um erro: {job.erro}")
+    restantes = job.ids_restantes()
+    if restantes:
+        exibir_progresso(job)
+        st.warning(f"{len(restantes)} pedidos ainda sem resposta de algum endpoint (cancelados ou com falha).")
+        if st.button("▶️ Retomar consulta dos pedidos restantes"):
+            iniciar_job(job.retomar())
+            st.rerun()
+    elif not st.session_state.dados_carregados and not st.session_state.ids_com_falha:
+        st.warning("A consulta principal (Sysemp-Detalhado) não retornou nenhum dado.")
+
+# --- Leitura do arquivo enviado ---
+def hash_upload(uploaded_file):
+    # Um mesmo upload mantém o file_id entre reruns; o hash do conteúdo é calculado uma vez só.
+    chave = (getattr(uploaded_file, 'file_id', None), uploaded_file.name, uploaded_file.size)
+    hashes = st.session_state.setdefault('hash_uploads', {})
+    if chave not in hashes:
+        hashes.clear()
+        hashes[chave] = hash_conteudo(uploaded_file.getvalue())
+    return hashes[chave]
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def carregar_cabecalho(hash_arquivo, nome_arquivo, _conteudo):
+    return ler_cabecalho(_conteudo, nome_arquivo)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def carregar_coluna(hash_arquivo, nome_arquivo, coluna, _conteudo):
+    return ler_coluna(_conteudo, nome_arquivo, coluna)
+
+# --- Análise memorizada entre reruns ---
+def obter_analise():
+    df_consolidado = st.session_state.get('df_consolidado', pd.DataFrame())
+    if df_consolidado.empty:
+        return None
+    fingerprint = st.session_state.get('fingerprint_dados')
+    analise = st.session_state.get('analise')
+    if analise is None or fingerprint is None or analise.fingerprint != fingerprint:
+        with obter_metricas().etapa("análise e classificação"):
+            analise = analisar_dados(df_consolidado, st.session_state.get('df_crm', pd.DataFrame()), fingerprint)
+        st.session_state.analise = analise
+    return analise
+
+# --- Exportação sob demanda ---
+def gerar_exportacao(tipo, formato, df_filtrado, analise):
+    if tipo == 'resumo':
+        df_export, planilha = montar_resumo(df_filtrado, analise.categorias), 'Resumo_por_Pedido'
+    else:
+        df_export, planilha = montar_detalhado(df_filtrado, crm_mais_recente_por_raw(analise.crm), analise.categorias), 'Detalhes_Nota_a_Nota'
+    descartar_exportacao()
+    limpar_exportacoes_antigas()
+    descritor, caminho = tempfile.mkstemp(suffix=f'.{formato}', prefix=f'{tipo}_pedidos_')
+    with obter_metricas().etapa(f"exportação {tipo} ({formato})"), os.fdopen(descritor, 'wb') as destino:
+        escrever(df_export, formato, destino, planilha)
+    nome = f"{'resumo' if tipo == 'resumo' else 'detalhes'}_pedidos_{datetime.now().strftime('%Y%m%d_%H%M')}.{formato}"
+    return {'caminho': caminho, 'nome': nome, 'formato': formato, 'tipo': tipo}
+
+def descartar_exportacao():
+    exportacao = st.session_state.pop('exportacao', None)
+    if exportacao and os.path.exists(exportacao['caminho']):
+        os.remove(exportacao['caminho'])
+
+def limpar_exportacoes_antigas():
+    # Arquivos de sessões encerradas (ou que nunca baixaram a exportação) não são removidos por ninguém mais.
+    limite = time.time() - IDADE_MAXIMA_EXPORTACAO
+    for tipo in ('resumo', 'detalhes'):
+        for caminho in glob.glob(os.path.join(tempfile.gettempdir(), f'{tipo}_pedidos_*')):
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    os.remove(caminho)
+            except OSError:
+                pass
 
 # --- Interface Principal do Streamlit ---
 st.title("Consulta Massiva de Pedidos Cancelados - Controladoria")
@@ -79,146 +192,65 @@ st.sidebar.header("Configurações da Consulta")
 
 if 'dados_carregados' not in st.session_state:
     st.session_state.dados_carregados = False
-    st.session_state.log_messages = []
+    st.session_state.metricas = MetricasExecucao()
     st.session_state.total_pedidos_input = 0
     st.session_state.ids_nao_encontrados = []
+    st.session_state.ids_com_falha = {}
 
-uploaded_file = st.sidebar.file_uploader("1. Escolha seu arquivo Excel:", type=["xlsx", "xls"], key="uploader")
+job = obter_job_atual()
+
+uploaded_file = st.sidebar.file_uploader("1. Escolha seu arquivo (Excel, CSV ou TXT):", type=EXTENSOES_SUPORTADAS, key="uploader")
 
 if uploaded_file:
     try:
-        df_excel = pd.read_excel(uploaded_file, engine='openpyxl' if uploaded_file.name.endswith('xlsx') else 'xlrd')
-        colunas = df_excel.columns.tolist()
+        hash_arquivo = hash_upload(uploaded_file)
+        colunas = carregar_cabecalho(hash_arquivo, uploaded_file.name, uploaded_file.getvalue())
         default_ix = next((i for i, c in enumerate(colunas) if 'pedido' in c.lower()), 0)
         coluna_selecionada = st.sidebar.selectbox("2. Selecione a coluna dos pedidos:", colunas, index=default_ix)
+        usar_cache = st.sidebar.checkbox("Usar cache local de consultas", value=True,
+                                         help="Reaproveita respostas recentes do Sysemp e consulta na rede apenas pedidos novos ou vencidos.")
+        reconsultar_tudo = st.sidebar.checkbox("Reconsultar todos os pedidos", value=False, disabled=not usar_cache,
+                                               help="Ignora o cache nesta execução e atualiza todas as respostas guardadas.")
         
         if st.sidebar.button("3. PROCESSAR CONSULTA", type="primary"):
-            st.session_state.dados_carregados, st.session_state.log_messages = False, []
+            st.session_state.dados_carregados = False
+            st.session_state.ids_nao_encontrados, st.session_state.ids_com_falha = [], {}
+            metricas = st.session_state.metricas = MetricasExecucao()
             
-            with st.spinner("Lendo e preparando os pedidos do arquivo..."):
-                df_base = df_excel[[coluna_selecionada]].copy().rename(columns={coluna_selecionada: "ID Original Excel"})
-                df_base.dropna(subset=["ID Original Excel"], inplace=True)
-                df_base["ID Original Excel"] = df_base["ID Original Excel"].astype(str).str.strip().str.upper().str.replace(r'\.0$', '', regex=True)
-                df_base.drop_duplicates(subset=["ID Original Excel"], inplace=True, keep='first')
-                
-                def preparar_id_para_bd(pedido_id_excel):
-                    id_str = str(pedido_id_excel).replace('_CANC', '')
-                    if len(id_str) == 11 and id_str.isnumeric():
-                        return id_str[:-2]
-                    return id_str
-                
-                df_base["ID_para_Consulta"] = df_base["ID Original Excel"].apply(preparar_id_para_bd)
+            with st.spinner("Lendo e preparando os pedidos do arquivo..."), metricas.etapa("leitura do arquivo"):
+                df_base = preparar_base_pedidos(carregar_coluna(hash_arquivo, uploaded_file.name, coluna_selecionada, uploaded_file.getvalue()))
                 ids_limpos = df_base["ID_para_Consulta"].unique().tolist()
                 st.session_state.total_pedidos_input = len(df_base)
 
             if not df_base.empty:
-                with st.spinner(f"Consultando {len(ids_limpos)} pedidos nas APIs Sysemp..."):
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                        future_detalhado = executor.submit(consultar_api_sysemp, API_PEDIDO_DETALHADO_URL, ids_limpos, "Sysemp-Detalhado", max_workers=2)
-                        future_crm = executor.submit(consultar_api_sysemp, API_CRM_URL, ids_limpos, "Sysemp-CRM", max_workers=2)
-                        
-                        df_detalhado = future_detalhado.result()
-                        df_crm = future_crm.result()
-                
-                st.success("Consulta às APIs concluída! Consolidando e analisando os dados...")
-
-                if not df_detalhado.empty:
-                    st.session_state.df_consolidado = df_detalhado
-                    st.session_state.df_crm = df_crm
-                    st.session_state.dados_carregados = True
-                else:
-                    st.warning("A consulta principal (Sysemp-Detalhado) não retornou nenhum dado.")
-
-                pedidos_encontrados = set(df_detalhado['pedido_normalizado'].unique()) if not df_detalhado.empty else set()
-                st.session_state.ids_nao_encontrados = list(set(ids_limpos) - pedidos_encontrados)
+                if job is not None:
+                    job.cancelar()
+                cache = obter_cache_sysemp() if usar_cache else None
+                job = JobConsulta(ids_limpos, ENDPOINTS_SYSEMP, API_CONTROLADORIA_HEADERS, cache=cache, reconsultar_tudo=reconsultar_tudo,
+                                  metricas=metricas, total_linhas=len(df_base), consultor=obter_consultor_sysemp(),
+                                  concorrencia_maxima=SYSEMP_MAX_CONCORRENCIA_GLOBAL)
+                iniciar_job(job)
+                log_message('info', f"Consulta de {len(ids_limpos)} pedidos iniciada em segundo plano.", metricas)
 
     except Exception as e:
         st.error(f"Ocorreu um erro geral no processamento: {e}")
         import traceback; log_message('error', traceback.format_exc())
 
-# ===== SEÇÃO DE EXIBIÇÃO E FILTROS =====
-if st.session_state.get('dados_carregados') or st.session_state.get('ids_nao_encontrados'):
-    df_display_raw = st.session_state.get('df_consolidado', pd.DataFrame())
-    df_crm_raw = st.session_state.get('df_crm', pd.DataFrame())
+if job is not None:
+    if job.ativo:
+        painel_job_em_andamento(job)
+    else:
+        painel_job_finalizado(job)
 
-    final_audit_map = {}
-    
-    if not df_display_raw.empty:
-        df_display_raw['valor_normalizado'] = pd.to_numeric(df_display_raw['valor_normalizado'], errors='coerce').fillna(0)
-        resumo_valores = df_display_raw.groupby('pedido_normalizado')['valor_normalizado'].sum()
-        validacoes_por_pedido = df_display_raw.groupby('pedido_normalizado')['validacao_pedido'].unique().apply(set)
-        pedidos_com_nota = validacoes_por_pedido[validacoes_por_pedido != {'Pedido'}].index
-
-        ids_faturamento_cancelado = []
-        df_notas_fiscais = df_display_raw[df_display_raw['validacao_pedido'] != 'Pedido'].copy()
-        if not df_notas_fiscais.empty:
-            df_notas_fiscais['is_canceled'] = (df_notas_fiscais['nfe_cstat'] == '101') | (df_notas_fiscais['pedido_raw'].str.endswith('_CANC', na=False))
-            pedidos_totalmente_cancelados_check = df_notas_fiscais.groupby('pedido_normalizado')['is_canceled'].all()
-            ids_faturamento_cancelado = pedidos_totalmente_cancelados_check[pedidos_totalmente_cancelados_check].index.tolist()
-
-        ids_caso1, ids_caso2, ids_caso3, ids_caso4, ids_caso5 = [], [], [], [], []
-        ids_cobranca_ativa, ids_carta_debito, ids_outras_tratativas = [], [], []
-
-        if not df_crm_raw.empty:
-            df_crm_raw['datahora_andamento'] = pd.to_datetime(df_crm_raw['datahora_andamento'], errors='coerce')
-            pedidos_positivos = resumo_valores[resumo_valores > 0].index
-            
-            pedidos_com_tratativa_real = df_crm_raw[df_crm_raw['andamento_descricao'] != 'EM EXPEDIÇÃO']['pedido_normalizado'].unique()
-            ids_caso1 = [pid for pid in pedidos_positivos if pid not in pedidos_com_tratativa_real and pid not in ids_faturamento_cancelado]
-            
-            df_crm_recente_por_raw = df_crm_raw.sort_values('datahora_andamento', ascending=False).drop_duplicates('pedido_raw', keep='first')
-            regex_cancelamento = re.compile(r'^LIB.*CANC', re.IGNORECASE)
-            cancelamentos_pendentes_raw = df_crm_recente_por_raw[df_crm_recente_por_raw['andamento_obs'].str.contains(regex_cancelamento, na=False, regex=True)]
-            ids_caso2 = cancelamentos_pendentes_raw['pedido_normalizado'].unique().tolist()
-            
-            df_crm_recente_por_norm = df_crm_raw.sort_values('datahora_andamento', ascending=False).drop_duplicates('pedido_normalizado', keep='first')
-            pedidos_finalizados_crm = df_crm_recente_por_norm[df_crm_recente_por_norm['andamento_descricao'].str.startswith('FINAL', na=False)]['pedido_normalizado'].unique()
-            ids_caso5 = list(set(pedidos_com_nota) & set(pedidos_finalizados_crm))
-
-            regex_cobranca = re.compile(r'JUR[ÍI]D|COBRAN[ÇC]|REVERSA.*?PAGAMENTO', re.IGNORECASE)
-            pedidos_em_cobranca_crm = df_crm_raw[df_crm_raw['andamento_descricao'].str.contains(regex_cobranca, na=False)]['pedido_normalizado'].unique()
-            ids_cobranca_ativa = list(set(pedidos_positivos) & set(pedidos_em_cobranca_crm))
-
-            # --- LÓGICA CORRIGIDA PARA CARTA DE DÉBITO ---
-            regex_obs_debito_enviado = re.compile(r'BITO.*?ENV', re.IGNORECASE)
-            pedidos_carta_debito_crm = df_crm_raw[
-                (df_crm_raw['andamento_descricao'] == 'FINALIZADO') &
-                (df_crm_raw['andamento_obs'].str.contains(regex_obs_debito_enviado, na=False))
-            ]['pedido_normalizado'].unique()
-            ids_carta_debito = list(set(pedidos_positivos) & set(pedidos_carta_debito_crm))
-            
-            pedidos_em_andamento = list(set(pedidos_com_tratativa_real) - set(pedidos_finalizados_crm))
-            ids_tratativa_geral = list(set(pedidos_com_nota) & set(pedidos_em_andamento))
-            ids_outras_tratativas = list(set(ids_tratativa_geral) - set(ids_cobranca_ativa) - set(ids_carta_debito) - set(ids_faturamento_cancelado))
-
-        pedidos_so_com_pedido = validacoes_por_pedido[validacoes_por_pedido == {'Pedido'}].index
-        pedidos_bloqueados_T = df_display_raw[df_display_raw['bloqueada'] == 'T']['pedido_normalizado'].unique()
-        ids_caso3 = list(set(pedidos_so_com_pedido) & set(pedidos_bloqueados_T))
-
-        pedidos_valor_zero = resumo_valores[(resumo_valores > -1) & (resumo_valores < 1)].index
-        ids_caso4 = list(set(pedidos_com_nota) & set(pedidos_valor_zero) - set(ids_faturamento_cancelado))
-
-        priority_order = [
-            ('Pedidos com Cancelamento Pendente', ids_caso2),
-            ('Pedidos Bloqueados sem Faturamento', ids_caso3),
-            ('Pedidos com Faturamento Cancelado', ids_faturamento_cancelado),
-            ('Pedidos Devolvidos', ids_caso4),
-            ('Pedido com Carta de Débito', ids_carta_debito), 
-            ('Pedidos Finalizados', ids_caso5),
-            ('Pedido com Cobrança Ativa', ids_cobranca_ativa),           
-            ('Pedidos em Outras Tratativas', ids_outras_tratativas), 
-            ('Pedidos Pendentes de Tratativa', ids_caso1)
-        ]
-        
-        for pid in df_display_raw['pedido_normalizado'].unique():
-            for name, id_list in priority_order:
-                if pid in id_list:
-                    final_audit_map[pid] = name; break
-            if pid not in final_audit_map: final_audit_map[pid] = 'OK'
-                
-        counts = pd.Series(final_audit_map.values()).value_counts()
+# ===== SEÇÃO DE EXIBIÇÃO E FILTROS =====
+if st.session_state.get('dados_carregados') or st.session_state.get('ids_nao_encontrados') or st.session_state.get('ids_com_falha'):
+    analise = obter_analise()
+    if analise is not None:
+        df_display_raw, df_crm_raw = analise.df_consolidado, analise.crm
+        final_audit_map, counts = analise.categorias, analise.contagens
     else:
-        counts = pd.Series()
+        df_display_raw, df_crm_raw = pd.DataFrame(), pd.DataFrame()
+        final_audit_map, counts = pd.Series(dtype=object), pd.Series()
 
     st.markdown(f"<h2 style='text-align: center;'>Visão Geral de {st.session_state.total_pedidos_input} Pedidos Computados</h2>", unsafe_allow_html=True)
     
@@ -234,10 +266,11 @@ if st.session_state.get('dados_carregados') or st.session_state.get('ids_nao_enc
     col7.metric(label="Pedidos em Outras Tratativas", value=counts.get('Pedidos em Outras Tratativas', 0))
     col8.metric(label="Pedidos Finalizados", value=counts.get('Pedidos Finalizados', 0))
 
-    col9, col10, col11, _ = st.columns(4)
+    col9, col10, col11, col12 = st.columns(4)
     col9.metric(label="Pedidos com Faturamento Cancelado", value=counts.get('Pedidos com Faturamento Cancelado', 0))
     col10.metric(label="Não Encontrados no Sysemp", value=len(st.session_state.ids_nao_encontrados))
-    with col11:
+    col11.metric(label="Falha na Consulta ao Sysemp", value=len(st.session_state.get('ids_com_falha', {})))
+    with col12:
         total_pedidos, sem_tratativa = st.session_state.total_pedidos_input, counts.get('Pedidos Pendentes de Tratativa', 0)
         st.metric(label="Indicador de Controle", value=f"{(total_pedidos - sem_tratativa) / total_pedidos:.1%}" if total_pedidos > 0 else "N/A")
 
@@ -245,85 +278,133 @@ if st.session_state.get('dados_carregados') or st.session_state.get('ids_nao_enc
     st.subheader("Casos para Auditoria")
     
     opcoes_auditoria = ['Todos']
-    if 'priority_order' in locals():
-        opcoes_auditoria.extend([name for name, _ in priority_order])
+    if not df_display_raw.empty:
+        opcoes_auditoria.extend(CATEGORIAS_AUDITORIA)
     opcoes_auditoria.append('Não Encontrados no Sysemp')
+    opcoes_auditoria.append('Falha na Consulta ao Sysemp')
     
     filtro_auditoria = st.selectbox("Selecione um caso de auditoria:", options=opcoes_auditoria, label_visibility="collapsed")
     
-    df_filtrado_base = pd.DataFrame()
+    mostrar_pedidos = False
     if filtro_auditoria == 'Não Encontrados no Sysemp':
         if st.session_state.ids_nao_encontrados:
             st.info(f"Exibindo {len(st.session_state.ids_nao_encontrados)} pedidos não encontrados na base do Sysemp.")
             st.dataframe(pd.DataFrame(st.session_state.ids_nao_encontrados, columns=['ID do Pedido (Normalizado)']))
         else:
             st.success("✅ Todos os pedidos foram encontrados na base do Sysemp.")
+    elif filtro_auditoria == 'Falha na Consulta ao Sysemp':
+        ids_com_falha = st.session_state.get('ids_com_falha', {})
+        if ids_com_falha:
+            st.warning(f"Exibindo {len(ids_com_falha)} pedidos cuja consulta falhou mesmo após as novas tentativas. Reprocesse-os antes de auditar.")
+            st.dataframe(pd.DataFrame(list(ids_com_falha.items()), columns=['ID do Pedido (Normalizado)', 'Erro']))
+        else:
+            st.success("✅ Nenhuma falha de consulta ao Sysemp.")
     elif not df_display_raw.empty:
-        df_filtrado_base = df_display_raw.copy()
-        if filtro_auditoria != 'Todos':
-            pids_filtrados = [pid for pid, cat in final_audit_map.items() if cat == filtro_auditoria]
-            df_filtrado_base = df_filtrado_base[df_filtrado_base['pedido_normalizado'].isin(pids_filtrados)]
+        categoria_filtro = None if filtro_auditoria == 'Todos' else filtro_auditoria
+        mostrar_pedidos = categoria_filtro is None or counts.get(categoria_filtro, 0) > 0
 
-    if not df_filtrado_base.empty:
+    if mostrar_pedidos:
         st.subheader("Filtros Gerais")
         # --- FILTROS RESTAURADOS ---
         fcol1, fcol2, fcol3 = st.columns(3)
         with fcol1: filtro_pedido = st.text_input("Número do Pedido:")
-        with fcol2: filtro_canal = st.selectbox("Canal de Venda:", ['Todos'] + sorted(df_display_raw['canal_venda'].dropna().unique().tolist()))
-        with fcol3: filtro_id_empresa = st.selectbox("ID Empresa:", ['Todos'] + sorted(df_display_raw['id_empresa'].dropna().unique().tolist()))
+        with fcol2: filtro_canal = st.selectbox("Canal de Venda:", ['Todos'] + analise.opcoes_filtros.get('canal_venda', []))
+        with fcol3: filtro_id_empresa = st.selectbox("ID Empresa:", ['Todos'] + analise.opcoes_filtros.get('id_empresa', []))
         
         fcol4, fcol5 = st.columns(2)
-        with fcol4: filtro_motivo_bloqueio = st.selectbox("Motivo Bloqueio Pedido:", ['Todos'] + sorted(df_display_raw['motivo_bloqueio'].dropna().unique().tolist()))
-        with fcol5: filtro_transportadora = st.selectbox("Transportadora:", ['Todos'] + sorted(df_display_raw['transportadora'].dropna().unique().tolist()))
+        with fcol4: filtro_motivo_bloqueio = st.selectbox("Motivo Bloqueio Pedido:", ['Todos'] + analise.opcoes_filtros.get('motivo_bloqueio', []))
+        with fcol5: filtro_transportadora = st.selectbox("Transportadora:", ['Todos'] + analise.opcoes_filtros.get('transportadora', []))
 
-        df_filtrado = df_filtrado_base.copy()
-        if filtro_pedido: df_filtrado = df_filtrado[df_filtrado['pedido_normalizado'].str.contains(filtro_pedido.upper(), na=False)]
-        if filtro_canal != 'Todos': df_filtrado = df_filtrado[df_filtrado['canal_venda'] == filtro_canal]
-        if filtro_id_empresa != 'Todos': df_filtrado = df_filtrado[df_filtrado['id_empresa'] == filtro_id_empresa]
-        if filtro_motivo_bloqueio != 'Todos': df_filtrado = df_filtrado[df_filtrado['motivo_bloqueio'] == filtro_motivo_bloqueio]
-        if filtro_transportadora != 'Todos': df_filtrado = df_filtrado[df_filtrado['transportadora'] == filtro_transportadora]
+        # Só a filtragem roda a cada interação; a análise fica memorizada em `analise`.
+        mascara_filtros = analise.mascara(
+            categoria=categoria_filtro, pedido=filtro_pedido,
+            canal_venda=None if filtro_canal == 'Todos' else filtro_canal,
+            id_empresa=None if filtro_id_empresa == 'Todos' else filtro_id_empresa,
+            motivo_bloqueio=None if filtro_motivo_bloqueio == 'Todos' else filtro_motivo_bloqueio,
+            transportadora=None if filtro_transportadora == 'Todos' else filtro_transportadora)
+        df_filtrado = df_display_raw[mascara_filtros]
 
 
         st.markdown("---")
         st.subheader("Análise Detalhada por Pedido")
         if not df_filtrado.empty:
-            tabela_resumo = df_filtrado.groupby('pedido_normalizado').agg(
-                canal_venda=('canal_venda', 'first'), data_pedido=('data_pedido', 'first'), valor_liquido=('valor_normalizado', 'sum')
-            ).reset_index()
-
-            for _, row in tabela_resumo.iterrows():
-                pedido_norm = row['pedido_normalizado']
+            # O resumo por pedido vem pronto da análise; por rerun só a soma filtrada e a página.
+            codigos_filtrados, valores_filtrados = analise.pedidos_filtrados(mascara_filtros)
+
+            pcol1, pcol2, _ = st.columns([1, 1, 2])
+            with pcol1: tamanho_pagina = st.selectbox("Pedidos por página:", TAMANHOS_PAGINA_DETALHE, index=1)
+            total_paginas = max(1, math.ceil(len(codigos_filtrados) / tamanho_pagina))
+            with pcol2: pagina = st.number_input(f"Página (de {total_paginas}):", min_value=1, max_value=total_paginas, value=1, step=1)
+            inicio_pagina = (pagina - 1) * tamanho_pagina
+            codigos_pagina = codigos_filtrados[inicio_pagina:inicio_pagina + tamanho_pagina]
+            pagina_resumo = analise.tabela_pedidos(codigos_pagina, valores_filtrados)
+            st.caption(f"Exibindo pedidos {inicio_pagina + 1}–{inicio_pagina + len(pagina_resumo)} de {len(codigos_filtrados)}.")
+
+            for row, codigo_pedido in zip(pagina_resumo.itertuples(index=False), codigos_pagina):
+                pedido_norm = row.pedido_normalizado
                 categoria_auditoria = final_audit_map.get(pedido_norm, 'OK')
-                expander_title = f"[{categoria_auditoria}] Pedido: {pedido_norm} | Canal: {row['canal_venda']} | Valor: R$ {row['valor_liquido']:,.2f}"
+                expander_title = f"[{categoria_auditoria}] Pedido: {pedido_norm} | Canal: {row.canal_venda} | Valor: R$ {row.valor_liquido:,.2f}"
                 
                 with st.expander(expander_title):
                     st.markdown("<h6>Detalhes do Pedido</h6>", unsafe_allow_html=True)
-                    detalhes_pedido = df_filtrado[df_filtrado['pedido_normalizado'] == pedido_norm].copy()
+                    detalhes_pedido = analise.linhas_sysemp(codigo_pedido, mascara_filtros)
                     st.dataframe(detalhes_pedido, use_container_width=True, hide_index=True)
                     
                     st.markdown("<h6>Andamentos no CRM</h6>", unsafe_allow_html=True)
-                    detalhes_crm = df_crm_raw[df_crm_raw['pedido_normalizado'] == pedido_norm].copy()
+                    detalhes_crm = analise.linhas_crm(codigo_pedido)
                     if not detalhes_crm.empty:
-                        detalhes_crm['datahora_andamento'] = pd.to_datetime(detalhes_crm['datahora_andamento'], errors='coerce').dt.strftime('%d/%m/%Y %H:%M:%S')
-                        st.dataframe(detalhes_crm.sort_values(by='datahora_andamento', ascending=False), use_container_width=True, hide_index=True)
+                        # As linhas já vêm do andamento mais recente para o mais antigo.
+                        detalhes_crm = detalhes_crm.assign(datahora_andamento=detalhes_crm['datahora_andamento'].dt.strftime('%d/%m/%Y %H:%M:%S'))
+                        st.dataframe(detalhes_crm, use_container_width=True, hide_index=True)
                     else:
                         st.info("Nenhum andamento de CRM encontrado para este pedido.")
         else:
             st.info("Nenhum pedido corresponde aos filtros selecionados.")
             
         st.markdown("---")
-        st.subheader("Exportar Resultados em .xlsx")
+        st.subheader("Exportar Resultados")
         if not df_filtrado.empty:
-            colE1, colE2 = st.columns(2)
-            excel_resumido = gerar_excel_resumido(df_filtrado.groupby('pedido_normalizado').agg(canal_venda=('canal_venda', 'max'),data_pedido=('data_pedido', 'max'),valor_liquido=('valor_normalizado', 'sum')).reset_index(), final_audit_map)
-            colE1.download_button(label="📥 Exportar Resumo", data=excel_resumido, file_name=f"resumo_pedidos_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
-            
-            excel_detalhado = gerar_excel_detalhado(df_filtrado, df_crm_raw, final_audit_map)
-            colE2.download_button(label="📥 Exportar Detalhes", data=excel_detalhado, file_name=f"detalhes_pedidos_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx")
+            # O arquivo só é gerado quando pedido e fica guardado enquanto os filtros não mudam.
+            chave_exportacao = (analise.fingerprint, filtro_auditoria, filtro_pedido, filtro_canal, filtro_id_empresa, filtro_motivo_bloqueio, filtro_transportadora)
+            exportacao = st.session_state.get('exportacao')
+            if exportacao and (exportacao['chave'] != chave_exportacao or not os.path.exists(exportacao['caminho'])):
+                descartar_exportacao()
+                exportacao = None
+
+            colF, colE1, colE2 = st.columns([1, 1, 1])
+            formato_exportacao = colF.selectbox("Formato:", formatos_disponiveis(), label_visibility="collapsed")
+            for coluna, tipo, rotulo in ((colE1, 'resumo', "⚙️ Gerar Resumo"), (colE2, 'detalhes', "⚙️ Gerar Detalhes")):
+                if coluna.button(rotulo, use_container_width=True):
+                    with st.spinner("Gerando arquivo de exportação..."):
+                        exportacao = gerar_exportacao(tipo, formato_exportacao, df_filtrado, analise)
+                        exportacao['chave'] = chave_exportacao
+                        st.session_state.exportacao = exportacao
+
+            if exportacao:
+                # Baixado o arquivo, ele sai da sessão e do disco; o botão some no rerun e o Streamlit libera a cópia em memória.
+                with open(exportacao['caminho'], 'rb') as arquivo:
+                    st.download_button(label=f"📥 Baixar {exportacao['nome']}", data=arquivo, file_name=exportacao['nome'],
+                                       mime=MIME_TYPES[exportacao['formato']], on_click=descartar_exportacao)
         else:
             st.info("Nenhum dado para exportar com base nos filtros.")
 
-if st.session_state.get('log_messages'):
-    with st.expander("Ver Logs de Processamento", expanded=False):
-        for log in reversed(st.session_state.log_messages):
+metricas = obter_metricas()
+# O resumo e o JSON só são montados com o painel aberto; fechado, o rerun não paga por eles.
+if not metricas.vazio() and st.toggle("Ver Logs de Processamento", value=False):
+    resumo_metricas = metricas.resumo()
+    with st.container(border=True):
+        if resumo_metricas['etapas']:
+            st.markdown("<h6>Tempo por Etapa</h6>", unsafe_allow_html=True)
+            st.dataframe(pd.DataFrame(resumo_metricas['etapas']), use_container_width=True, hide_index=True)
+        if resumo_metricas['endpoints']:
+            st.markdown("<h6>Requisições por Endpoint</h6>", unsafe_allow_html=True)
+            st.dataframe(pd.DataFrame.from_dict(resumo_metricas['endpoints'], orient='index').drop(columns='erros_por_tipo'), use_container_width=True)
+        if resumo_metricas['contadores']:
+            st.dataframe(pd.Series(resumo_metricas['contadores'], name='total'), use_container_width=True)
+        consultas_processo = obter_consultor_sysemp().estatisticas()
+        st.markdown("<h6>Consultas ao Sysemp no Processo (todas as sessões)</h6>", unsafe_allow_html=True)
+        st.dataframe(pd.Series(consultas_processo, name='total'), use_container_width=True)
+        for log in metricas.logs_recentes():
             st.text(f"[{log['time'].strftime('%H:%M:%S')}] {log['level'].upper()}: {log['content']}")
+        st.download_button(label="📥 Exportar Métricas (JSON)", data=metricas.to_json(resumo_metricas, consultas_processo=consultas_processo), mime='application/json',
+                           file_name=f"metricas_{metricas.inicio.strftime('%Y%m%d_%H%M%S')}.json")
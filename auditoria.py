@@ -0,0 +1,270 @@
+"""Regras de auditoria dos pedidos cancelados, sem dependência do Streamlit.
+
+Cada pedido (`pedido_normalizado`) recebe uma única categoria: a primeira de
+`CATEGORIAS_AUDITORIA` cuja regra ele satisfaz, ou `CATEGORIA_OK`. As regras são
+avaliadas de forma vetorizada sobre agregados por pedido calculados numa única
+passada pelos dados do Sysemp e do CRM.
+"""
+import hashlib
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+CATEGORIA_OK = 'OK'
+
+# Ordem de prioridade: um pedido que atende a mais de uma regra fica na primeira.
+CAT_CANCELAMENTO_PENDENTE = 'Pedidos com Cancelamento Pendente'
+CAT_BLOQUEADO_SEM_FATURAMENTO = 'Pedidos Bloqueados sem Faturamento'
+CAT_FATURAMENTO_CANCELADO = 'Pedidos com Faturamento Cancelado'
+CAT_DEVOLVIDO = 'Pedidos Devolvidos'
+CAT_CARTA_DEBITO = 'Pedido com Carta de Débito'
+CAT_FINALIZADO = 'Pedidos Finalizados'
+CAT_COBRANCA_ATIVA = 'Pedido com Cobrança Ativa'
+CAT_OUTRAS_TRATATIVAS = 'Pedidos em Outras Tratativas'
+CAT_PENDENTE_TRATATIVA = 'Pedidos Pendentes de Tratativa'
+
+CATEGORIAS_AUDITORIA = [
+    CAT_CANCELAMENTO_PENDENTE,
+    CAT_BLOQUEADO_SEM_FATURAMENTO,
+    CAT_FATURAMENTO_CANCELADO,
+    CAT_DEVOLVIDO,
+    CAT_CARTA_DEBITO,
+    CAT_FINALIZADO,
+    CAT_COBRANCA_ATIVA,
+    CAT_OUTRAS_TRATATIVAS,
+    CAT_PENDENTE_TRATATIVA,
+]
+
+REGEX_CANCELAMENTO = re.compile(r'^LIB.*CANC', re.IGNORECASE)
+REGEX_COBRANCA = re.compile(r'JUR[ÍI]D|COBRAN[ÇC]|REVERSA.*?PAGAMENTO', re.IGNORECASE)
+REGEX_OBS_DEBITO_ENVIADO = re.compile(r'BITO.*?ENV', re.IGNORECASE)
+
+
+def preparar_crm(df_crm):
+    """Converte `datahora_andamento` e ordena do andamento mais recente para o
+    mais antigo (datas inválidas por último). Mantém o algoritmo de ordenação
+    padrão do pandas, de modo que empates de data escolham sempre o mesmo andamento."""
+    if not pd.api.types.is_datetime64_any_dtype(df_crm['datahora_andamento']):
+        df_crm = df_crm.assign(datahora_andamento=pd.to_datetime(df_crm['datahora_andamento'], errors='coerce'))
+    return df_crm.sort_values('datahora_andamento', ascending=False)
+
+
+def agregar_sysemp(df_consolidado):
+    valores = df_consolidado['valor_normalizado']
+    if not pd.api.types.is_numeric_dtype(valores):
+        valores = pd.to_numeric(valores, errors='coerce')
+    valores = valores.fillna(0)
+    e_pedido = (df_consolidado['validacao_pedido'] == 'Pedido').to_numpy(dtype=bool)
+    cancelada = ((df_consolidado['nfe_cstat'] == '101') | df_consolidado['pedido_raw'].str.endswith('_CANC', na=False)).to_numpy(dtype=bool)
+    linhas = pd.DataFrame({
+        'pedido_normalizado': df_consolidado['pedido_normalizado'].to_numpy(),
+        'valor': valores.to_numpy(),
+        'so_pedido': e_pedido,
+        'notas': ~e_pedido,
+        'notas_nao_canceladas': ~e_pedido & ~cancelada,
+        'bloqueado': (df_consolidado['bloqueada'] == 'T').to_numpy(dtype=bool),
+    })
+    return linhas.groupby('pedido_normalizado', sort=False).agg(
+        valor=('valor', 'sum'), so_pedido=('so_pedido', 'all'), notas=('notas', 'sum'),
+        notas_nao_canceladas=('notas_nao_canceladas', 'sum'), bloqueado=('bloqueado', 'any'))
+
+
+def agregar_crm(crm_ordenado):
+    """Agregados por pedido a partir do CRM já passado por `preparar_crm`."""
+    descricao, obs = crm_ordenado['andamento_descricao'], crm_ordenado['andamento_obs']
+    linhas = pd.DataFrame({
+        'pedido_normalizado': crm_ordenado['pedido_normalizado'].to_numpy(),
+        'tratativa_real': (descricao != 'EM EXPEDIÇÃO').to_numpy(dtype=bool),
+        'cobranca': descricao.str.contains(REGEX_COBRANCA, na=False).to_numpy(dtype=bool),
+        'carta_debito': ((descricao == 'FINALIZADO') & obs.str.contains(REGEX_OBS_DEBITO_ENVIADO, na=False)).to_numpy(dtype=bool),
+    })
+    agregados = linhas.groupby('pedido_normalizado', sort=False).any()
+
+    recente_por_norm = crm_ordenado.drop_duplicates('pedido_normalizado', keep='first')
+    finalizados = recente_por_norm.loc[recente_por_norm['andamento_descricao'].str.startswith('FINAL', na=False), 'pedido_normalizado']
+    recente_por_raw = crm_ordenado.drop_duplicates('pedido_raw', keep='first')
+    cancelamentos = recente_por_raw.loc[recente_por_raw['andamento_obs'].str.contains(REGEX_CANCELAMENTO, na=False, regex=True), 'pedido_normalizado']
+
+    agregados['finalizado'] = agregados.index.isin(finalizados)
+    agregados['cancelamento_pendente'] = agregados.index.isin(cancelamentos)
+    return agregados
+
+
+def classificar_pedidos(df_consolidado, df_crm, crm_ordenado=False):
+    """Devolve uma Series `pedido_normalizado -> categoria` com todos os pedidos
+    de `df_consolidado`, na ordem em que aparecem."""
+    pedidos = pd.Index(df_consolidado['pedido_normalizado'].unique(), name='pedido_normalizado')
+    if df_consolidado.empty:
+        return pd.Series(CATEGORIA_OK, index=pedidos, dtype=object)
+
+    sysemp = agregar_sysemp(df_consolidado)
+    tem_crm = df_crm is not None and not df_crm.empty
+    if tem_crm:
+        crm = agregar_crm(df_crm if crm_ordenado else preparar_crm(df_crm))
+        crm = crm.reindex(sysemp.index, fill_value=False)
+    else:
+        crm = pd.DataFrame(False, index=sysemp.index,
+                           columns=['tratativa_real', 'cobranca', 'carta_debito', 'finalizado', 'cancelamento_pendente'])
+
+    valor = sysemp['valor'].to_numpy()
+    so_pedido = sysemp['so_pedido'].to_numpy(dtype=bool)
+    com_nota = ~so_pedido
+    positivo = valor > 0
+    faturamento_cancelado = (sysemp['notas'].to_numpy() > 0) & (sysemp['notas_nao_canceladas'].to_numpy() == 0)
+    tratativa_real = crm['tratativa_real'].to_numpy(dtype=bool)
+    finalizado = crm['finalizado'].to_numpy(dtype=bool)
+    cobranca = positivo & crm['cobranca'].to_numpy(dtype=bool)
+    carta_debito = positivo & crm['carta_debito'].to_numpy(dtype=bool)
+
+    condicoes = [
+        crm['cancelamento_pendente'].to_numpy(dtype=bool),
+        so_pedido & sysemp['bloqueado'].to_numpy(dtype=bool),
+        faturamento_cancelado,
+        com_nota & (valor > -1) & (valor < 1) & ~faturamento_cancelado,
+        carta_debito,
+        com_nota & finalizado,
+        cobranca,
+        com_nota & tratativa_real & ~finalizado & ~cobranca & ~carta_debito & ~faturamento_cancelado,
+        tem_crm & positivo & ~tratativa_real & ~faturamento_cancelado,
+    ]
+    categorias = pd.Series(np.select(condicoes, CATEGORIAS_AUDITORIA, default=CATEGORIA_OK), index=sysemp.index, dtype=object)
+    return categorias.reindex(pedidos, fill_value=CATEGORIA_OK)
+
+
+def remover_pedidos(df_consolidado, pedidos):
+    """Tira as linhas dos `pedidos` informados. Usado para pedidos sem resposta
+    do CRM (falha ou ainda pendentes): sem os andamentos, as regras os
+    classificariam como se não houvesse tratativa nenhuma."""
+    pedidos = list(pedidos)
+    if df_consolidado.empty or not pedidos:
+        return df_consolidado
+    return df_consolidado[~df_consolidado['pedido_normalizado'].isin(pedidos)]
+
+
+# --- Análise memorizável por conjunto de dados ---
+COLUNAS_FILTRO = ['canal_venda', 'id_empresa', 'motivo_bloqueio', 'transportadora']
+COLUNAS_RESUMO_PEDIDO = ['canal_venda', 'data_pedido']
+
+
+def fingerprint_dados(*dfs):
+    """Impressão digital do conteúdo dos DataFrames (colunas e valores)."""
+    digest = hashlib.sha1()
+    for df in dfs:
+        if df is None:
+            digest.update(b'<None>')
+            continue
+        digest.update(repr(list(df.columns)).encode())
+        try:
+            hashes = pd.util.hash_pandas_object(df, index=False)
+        except TypeError:
+            # Colunas com listas/dicts vindas do JSON não são hasheáveis diretamente.
+            hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+        digest.update(hashes.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@dataclass
+class AnaliseAuditoria:
+    fingerprint: str
+    df_consolidado: pd.DataFrame
+    crm: pd.DataFrame
+    categorias: pd.Series
+    contagens: pd.Series
+    pedidos: pd.Series = None
+    categorias_pedidos: np.ndarray = None
+    codigos_pedido: np.ndarray = None
+    opcoes_filtros: dict = field(default_factory=dict)
+    indice_sysemp: tuple = None
+    indice_crm: tuple = None
+    resumo_pedidos: pd.DataFrame = None
+    ordem_pedidos: np.ndarray = None
+
+    def codigos(self, pedidos):
+        return pd.Index(self.pedidos).get_indexer(pedidos)
+
+    def linhas_sysemp(self, codigo, mascara=None):
+        posicoes = _posicoes(self.indice_sysemp, codigo)
+        if mascara is not None:
+            posicoes = posicoes[mascara[posicoes]]
+        return self.df_consolidado.iloc[posicoes]
+
+    def linhas_crm(self, codigo):
+        if self.crm.empty:
+            return self.crm
+        return self.crm.iloc[_posicoes(self.indice_crm, codigo)]
+
+    def mascara(self, categoria=None, pedido=None, **igualdades):
+        """Máscara booleana sobre as linhas de `df_consolidado`. A categoria e o
+        número do pedido são avaliados uma vez por pedido e expandidos por código."""
+        por_pedido = np.ones(len(self.pedidos), dtype=bool)
+        if categoria is not None:
+            por_pedido &= self.categorias_pedidos == categoria
+        if pedido:
+            por_pedido &= self.pedidos.str.contains(pedido.upper(), na=False).to_numpy(dtype=bool)
+        mascara = por_pedido[self.codigos_pedido]
+        for coluna, valor in igualdades.items():
+            if valor is not None:
+                mascara &= (self.df_consolidado[coluna] == valor).to_numpy(dtype=bool)
+        return mascara
+
+    def pedidos_filtrados(self, mascara):
+        """Códigos dos pedidos com alguma linha em `mascara`, em ordem de
+        `pedido_normalizado`, e o valor líquido de cada código somado só sobre
+        essas linhas (indexado pelo código)."""
+        codigos = self.codigos_pedido[mascara]
+        linhas = np.bincount(codigos, minlength=len(self.pedidos))
+        valores = np.bincount(codigos, weights=self.df_consolidado['valor_normalizado'].to_numpy(dtype=float)[mascara],
+                              minlength=len(self.pedidos))
+        return self.ordem_pedidos[linhas[self.ordem_pedidos] > 0], valores
+
+    def tabela_pedidos(self, codigos, valores):
+        """Linhas do resumo por pedido só para `codigos` (ex.: uma página)."""
+        return self.resumo_pedidos.iloc[codigos].assign(valor_liquido=valores[codigos])
+
+
+def _indexar(codigos, total):
+    """Agrupa as posições das linhas por código de pedido: as linhas do código
+    `c` ficam em `ordem[inicios[c]:inicios[c + 1]]`, na ordem original."""
+    ordem = np.argsort(codigos, kind='stable')
+    inicios = np.searchsorted(codigos[ordem], np.arange(total + 1))
+    return ordem, inicios
+
+
+def _posicoes(indice, codigo):
+    ordem, inicios = indice
+    if codigo < 0 or codigo + 1 >= len(inicios):
+        return ordem[:0]
+    return ordem[inicios[codigo]:inicios[codigo + 1]]
+
+
+def analisar_dados(df_consolidado, df_crm, fingerprint=None):
+    """Executa toda a parte cara da auditoria uma única vez por conjunto de dados."""
+    if fingerprint is None:
+        fingerprint = fingerprint_dados(df_consolidado, df_crm)
+    valores = df_consolidado['valor_normalizado']
+    if not pd.api.types.is_numeric_dtype(valores) or valores.isna().any():
+        df_consolidado = df_consolidado.assign(valor_normalizado=pd.to_numeric(valores, errors='coerce').fillna(0))
+    crm = preparar_crm(df_crm) if df_crm is not None and not df_crm.empty else pd.DataFrame()
+    categorias = classificar_pedidos(df_consolidado, crm, crm_ordenado=True)
+    codigos, pedidos = pd.factorize(df_consolidado['pedido_normalizado'], use_na_sentinel=False)
+    opcoes_filtros = {
+        coluna: sorted(df_consolidado[coluna].dropna().unique().tolist())
+        for coluna in COLUNAS_FILTRO if coluna in df_consolidado.columns
+    }
+    indice_crm = None
+    if not crm.empty:
+        codigos_crm = pd.Index(pedidos).get_indexer(crm['pedido_normalizado'])
+        indice_crm = _indexar(codigos_crm, len(pedidos))
+    # Colunas do resumo por pedido (primeiro valor não nulo), uma linha por código; o valor
+    # líquido depende dos filtros e é somado em `pedidos_filtrados`.
+    colunas_resumo = [coluna for coluna in COLUNAS_RESUMO_PEDIDO if coluna in df_consolidado.columns]
+    resumo_pedidos = df_consolidado[colunas_resumo].groupby(codigos).first().reset_index(drop=True)
+    resumo_pedidos.insert(0, 'pedido_normalizado', pedidos)
+    ordem_pedidos = pd.Series(pedidos, dtype=object).dropna().sort_values(kind='stable').index.to_numpy()
+    return AnaliseAuditoria(fingerprint=fingerprint, df_consolidado=df_consolidado, crm=crm, categorias=categorias,
+                            contagens=categorias.value_counts(), pedidos=pd.Series(pedidos, dtype=object),
+                            categorias_pedidos=categorias.reindex(pedidos).to_numpy(), codigos_pedido=codigos,
+                            opcoes_filtros=opcoes_filtros, indice_sysemp=_indexar(codigos, len(pedidos)),
+                            indice_crm=indice_crm, resumo_pedidos=resumo_pedidos, ordem_pedidos=ordem_pedidos)
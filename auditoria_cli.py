@@ -0,0 +1,162 @@
+"""Execução em lote da auditoria de pedidos cancelados, sem Streamlit.
+
+Exemplo:
+    python auditoria_cli.py pedidos.xlsx -o auditoria.xlsx --coluna Pedido --concorrencia 16
+
+As respostas do Sysemp são gravadas num checkpoint (SQLite) à medida que
+chegam; se a execução for interrompida, rodar o mesmo comando de novo consulta
+apenas os pedidos que faltaram. O checkpoint vale só para o mesmo arquivo e
+coluna de entrada e por --validade-checkpoint horas; é apagado ao final, a menos que
+--manter-checkpoint seja informado. Ctrl+C (ou SIGTERM) para de enviar pedidos,
+espera os que estão em andamento, grava o checkpoint e sai com código 130.
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import signal
+import sys
+import threading
+
+import pandas as pd
+
+from auditoria import analisar_dados, remover_pedidos
+from configuracao import API_CONTROLADORIA_HEADERS, API_CRM_URL, API_PEDIDO_DETALHADO_URL, TIPOS_POR_URL
+from exportacao import crm_mais_recente_por_raw, escrever, formatos_disponiveis, montar_detalhado, montar_resumo
+from ingestao import hash_conteudo, ler_cabecalho, ler_coluna, preparar_base_pedidos
+from sysemp_cache import CacheSysemp, consultar_com_cache
+from sysemp_client import registros_para_dataframe
+
+logger = logging.getLogger('auditoria_cli')
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Auditoria em lote de pedidos cancelados (Sysemp + CRM).")
+    parser.add_argument('entrada', help="Arquivo com os pedidos (xlsx, xls, csv ou txt).")
+    parser.add_argument('-o', '--saida', required=True, help="Arquivo de saída; o formato vem da extensão (xlsx, csv ou parquet).")
+    parser.add_argument('--coluna', help="Coluna dos pedidos. Padrão: a primeira cujo nome contém 'pedido'.")
+    parser.add_argument('--tipo', choices=['detalhes', 'resumo'], default='detalhes', help="Exportação nota a nota ou resumo por pedido.")
+    parser.add_argument('--concorrencia', type=int, default=32, help="Máximo de requisições simultâneas por endpoint.")
+    parser.add_argument('--concorrencia-inicial', type=int, default=2, help="Concorrência inicial antes do ajuste adaptativo.")
+    parser.add_argument('--checkpoint', help="Arquivo SQLite de checkpoint. Padrão: <saida>.checkpoint.sqlite")
+    parser.add_argument('--manter-checkpoint', action='store_true', help="Não apagar o checkpoint ao final.")
+    parser.add_argument('--validade-checkpoint', type=float, default=24,
+                        help="Horas em que uma resposta gravada no checkpoint ainda é reaproveitada. Padrão: 24.")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def _escolher_coluna(colunas, coluna):
+    if coluna:
+        if coluna not in colunas:
+            raise SystemExit(f"Coluna '{coluna}' não encontrada. Colunas disponíveis: {', '.join(colunas)}")
+        return coluna
+    return next((c for c in colunas if 'pedido' in c.lower()), colunas[0])
+
+
+def _instalar_interrupcao(cancelar):
+    def interromper(sinal, frame):
+        if cancelar.is_set():
+            raise KeyboardInterrupt
+        logger.warning("Interrupção recebida: aguardando as requisições em andamento e gravando o checkpoint "
+                       "(repita para abortar de imediato).")
+        cancelar.set()
+
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sinal, interromper)
+
+
+def _consultar(url, nome_api, ids, checkpoint, args, cancelar):
+    resultado, retomados = consultar_com_cache(checkpoint, url, ids, API_CONTROLADORIA_HEADERS, cancelar=cancelar,
+                                               concorrencia_inicial=args.concorrencia_inicial, concorrencia_maxima=args.concorrencia)
+    logger.info("(API %s) %d pedidos retomados do checkpoint, %d consultados; %d registros, %d falhas.",
+                nome_api, retomados, len(ids) - retomados - len(resultado.ids_pendentes), len(resultado.registros), len(resultado.ids_com_falha))
+    return registros_para_dataframe(resultado.registros, TIPOS_POR_URL.get(url)), resultado
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+
+    formato = args.saida.rsplit('.', 1)[-1].lower()
+    if formato not in formatos_disponiveis():
+        raise SystemExit(f"Formato de saída não suportado: {formato}. Use um de: {', '.join(formatos_disponiveis())}")
+
+    with open(args.entrada, 'rb') as arquivo:
+        conteudo = arquivo.read()
+    nome_arquivo = os.path.basename(args.entrada)
+    coluna = _escolher_coluna(ler_cabecalho(conteudo, nome_arquivo), args.coluna)
+    df_base = preparar_base_pedidos(ler_coluna(conteudo, nome_arquivo, coluna))
+    ids_limpos = df_base["ID_para_Consulta"].unique().tolist()
+    logger.info("%d pedidos lidos da coluna '%s' (%d IDs únicos para consulta).", len(df_base), coluna, len(ids_limpos))
+    if not ids_limpos:
+        logger.warning("Nenhum pedido para consultar.")
+        return 1
+
+    # O checkpoint pertence a uma entrada (conteúdo + coluna): outra planilha gravando na mesma saída não reaproveita respostas antigas.
+    caminho_checkpoint = args.checkpoint or f"{args.saida}.checkpoint.sqlite"
+    checkpoint = CacheSysemp(caminho_checkpoint, ttl_padrao=args.validade_checkpoint * 3600, max_entradas=sys.maxsize, lote_gravacao=50)
+    entrada = f"{hash_conteudo(conteudo)}:{coluna}"
+    entrada_checkpoint = checkpoint.obter_metadado('entrada')
+    if entrada_checkpoint != entrada:
+        if entrada_checkpoint is not None:
+            logger.warning("Checkpoint %s é de outro arquivo de entrada; descartando as respostas guardadas.", caminho_checkpoint)
+        checkpoint.limpar()
+        checkpoint.gravar_metadado('entrada', entrada)
+    cancelar = threading.Event()
+    _instalar_interrupcao(cancelar)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        future_detalhado = executor.submit(_consultar, API_PEDIDO_DETALHADO_URL, "Sysemp-Detalhado", ids_limpos, checkpoint, args, cancelar)
+        future_crm = executor.submit(_consultar, API_CRM_URL, "Sysemp-CRM", ids_limpos, checkpoint, args, cancelar)
+        df_detalhado, resultado_detalhado = future_detalhado.result()
+        df_crm, resultado_crm = future_crm.result()
+
+    if cancelar.is_set():
+        checkpoint.fechar()
+        pendentes = len(set(resultado_detalhado.ids_pendentes) | set(resultado_crm.ids_pendentes))
+        logger.warning("Execução interrompida com %d pedidos ainda sem consulta. Checkpoint gravado em %s; "
+                       "rode o mesmo comando para continuar.", pendentes, caminho_checkpoint)
+        return 130
+
+    ids_com_falha = set(resultado_detalhado.ids_com_falha) | set(resultado_crm.ids_com_falha)
+    pedidos_encontrados = set(df_detalhado['pedido_normalizado'].unique()) if not df_detalhado.empty else set()
+    ids_nao_encontrados = set(ids_limpos) - pedidos_encontrados - set(resultado_detalhado.ids_com_falha)
+
+    # Sem os andamentos do CRM o pedido seria classificado como se não tivesse tratativa; fica só nas pendências.
+    df_classificavel = remover_pedidos(df_detalhado, resultado_crm.ids_com_falha)
+    if df_detalhado.empty:
+        logger.warning("A consulta principal (Sysemp-Detalhado) não retornou nenhum dado.")
+    elif df_classificavel.empty:
+        logger.warning("Nenhum pedido com resposta completa do Sysemp para classificar.")
+    else:
+        analise = analisar_dados(df_classificavel, df_crm)
+        if args.tipo == 'resumo':
+            df_export, planilha = montar_resumo(analise.df_consolidado, analise.categorias), 'Resumo_por_Pedido'
+        else:
+            df_export, planilha = montar_detalhado(analise.df_consolidado, crm_mais_recente_por_raw(analise.crm), analise.categorias), 'Detalhes_Nota_a_Nota'
+        escrever(df_export, formato, args.saida, planilha)
+        logger.info("Resultado gravado em %s. Categorias: %s", args.saida,
+                    ', '.join(f"{categoria}={total}" for categoria, total in analise.contagens.items()))
+
+    if ids_nao_encontrados or ids_com_falha:
+        caminho_pendencias = f"{args.saida.rsplit('.', 1)[0]}_pendencias.csv"
+        pendencias = pd.DataFrame(
+            [(pid, 'Não Encontrado no Sysemp') for pid in sorted(ids_nao_encontrados)] +
+            [(pid, 'Falha na Consulta ao Sysemp') for pid in sorted(ids_com_falha)],
+            columns=['ID do Pedido (Normalizado)', 'Situação'])
+        pendencias.to_csv(caminho_pendencias, index=False, sep=';', encoding='utf-8-sig')
+        logger.info("%d não encontrados e %d falhas listados em %s.", len(ids_nao_encontrados), len(ids_com_falha), caminho_pendencias)
+
+    if ids_com_falha:
+        logger.warning("Checkpoint mantido em %s; rode o mesmo comando para reconsultar apenas as falhas.", caminho_checkpoint)
+        return 2
+    if not args.manter_checkpoint:
+        checkpoint.fechar()
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho_checkpoint + sufixo):
+                os.remove(caminho_checkpoint + sufixo)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Gerador de uploads e respostas Sysemp sintéticos para os benchmarks.
+
+Os dados seguem a forma das respostas reais: várias linhas por pedido (o
+pedido e suas notas), sufixos `_CANC`, `nfe_cstat` 101 para notas canceladas e
+andamentos de CRM com os textos que disparam cada regra de auditoria.
+"""
+import io
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from ingestao import preparar_id_para_bd
+from sysemp_client import TIPOS_ANDAMENTO_CRM, TIPOS_PEDIDO_DETALHADO, registros_para_dataframe
+
+CANAIS = ['MERCADO LIVRE', 'AMAZON', 'MAGALU', 'SITE', 'SHOPEE', 'VIA VAREJO']
+TRANSPORTADORAS = ['CORREIOS', 'JADLOG', 'TOTAL EXPRESS', 'LOGGI', None]
+MOTIVOS_BLOQUEIO = ['ANALISE DE CREDITO', 'DIVERGENCIA DE ESTOQUE', 'FRAUDE', None]
+EMPRESAS = [1, 2, 3, 5]
+DESCRICOES_CRM = ['EM EXPEDIÇÃO', 'FINALIZADO', 'FINALIZADO - REEMBOLSO', 'EM TRATATIVA', 'COBRANÇA', 'JURÍDICO',
+                  'REVERSA AGUARDANDO PAGAMENTO', 'AGUARDANDO CLIENTE']
+OBS_CRM = ['LIB PARA CANCELAMENTO', 'Liberado p/ canc. no marketplace', 'Carta de débito enviada ao cliente',
+           'Cliente contatado por e-mail', 'Aguardando retorno da transportadora', '', None]
+USUARIOS = ['ana.souza', 'bruno.lima', 'carla.mendes', 'diego.rocha']
+
+
+def gerar_ids(quantidade, seed=0):
+    """IDs como aparecem na planilha: parte com 11 dígitos (2 de sufixo) e parte com `_CANC`."""
+    rng = random.Random(seed)
+    ids = []
+    for i in range(quantidade):
+        base = f"{100000000 + i * 7:09d}"
+        sorteio = rng.random()
+        if sorteio < 0.2:
+            ids.append(base + f"{rng.randint(0, 99):02d}")
+        elif sorteio < 0.3:
+            ids.append(base + '_CANC')
+        else:
+            ids.append(base)
+    return ids
+
+
+def gerar_upload(quantidade, formato='xlsx', seed=0):
+    """Conteúdo (bytes) de um upload com a coluna de pedidos e algumas colunas extras."""
+    rng = random.Random(seed)
+    ids = gerar_ids(quantidade, seed)
+    df = pd.DataFrame({
+        'Data': [datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 365)) for _ in ids],
+        'Numero Pedido': ids,
+        'Cliente': [f"Cliente {rng.randint(1, 50000)}" for _ in ids],
+        'Valor': [round(rng.uniform(10, 5000), 2) for _ in ids],
+    })
+    saida = io.BytesIO()
+    if formato == 'xlsx':
+        df.to_excel(saida, index=False)
+    elif formato == 'csv':
+        df.to_csv(saida, index=False, sep=';')
+    else:
+        saida.write('\n'.join(ids).encode())
+    return saida.getvalue()
+
+
+def gerar_resposta_detalhada(pedido, rng):
+    """Linhas de `/controladoria-pedido-detalhado` para um pedido (lista vazia = não encontrado)."""
+    if rng.random() < 0.03:
+        return []
+    canal, empresa = rng.choice(CANAIS), rng.choice(EMPRESAS)
+    data_pedido = (datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 365))).strftime('%Y-%m-%d')
+    bloqueada = 'T' if rng.random() < 0.15 else 'F'
+    comum = {'pedido_normalizado': pedido, 'canal_venda': canal, 'id_empresa': empresa, 'data_pedido': data_pedido,
+             'transportadora': rng.choice(TRANSPORTADORAS), 'motivo_bloqueio': rng.choice(MOTIVOS_BLOQUEIO) if bloqueada == 'T' else None,
+             'bloqueada': bloqueada}
+    valor = round(rng.uniform(10, 5000), 2)
+    linhas = [dict(comum, pedido_raw=pedido, validacao_pedido='Pedido', nfe_cstat=None, valor_normalizado=str(valor))]
+    for _ in range(rng.choice([0, 1, 1, 1, 2])):
+        cancelada = rng.random() < 0.35
+        devolvida = not cancelada and rng.random() < 0.3
+        linhas.append(dict(comum, pedido_raw=pedido + ('_CANC' if cancelada and rng.random() < 0.5 else ''),
+                           validacao_pedido='Devolução' if devolvida else 'Nota Fiscal',
+                           nfe_cstat='101' if cancelada else '100',
+                           valor_normalizado=str(-valor if devolvida else valor)))
+    return linhas
+
+
+def gerar_resposta_crm(pedido, rng):
+    """Andamentos de `/controle-andamento-crm` para um pedido."""
+    inicio = datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 500000))
+    linhas = []
+    for i in range(rng.choice([0, 1, 2, 3, 5])):
+        linhas.append({
+            'pedido_normalizado': pedido, 'pedido_raw': pedido,
+            'datahora_andamento': (inicio + timedelta(hours=i * rng.randint(1, 48))).strftime('%Y-%m-%d %H:%M:%S'),
+            'andamento_descricao': rng.choice(DESCRICOES_CRM), 'andamento_obs': rng.choice(OBS_CRM),
+            'usuario_andamento': rng.choice(USUARIOS),
+        })
+    return linhas
+
+
+def gerar_dataframes(quantidade, seed=0):
+    """(df_consolidado, df_crm) como sairiam de `consultar_api_sysemp` para `quantidade` pedidos."""
+    rng = random.Random(seed)
+    detalhado, crm = [], []
+    for id_planilha in gerar_ids(quantidade, seed):
+        pedido = preparar_id_para_bd(id_planilha)
+        detalhado.extend(gerar_resposta_detalhada(pedido, rng))
+        crm.extend(gerar_resposta_crm(pedido, rng))
+    return registros_para_dataframe(detalhado, TIPOS_PEDIDO_DETALHADO), registros_para_dataframe(crm, TIPOS_ANDAMENTO_CRM)
@@ -0,0 +1,110 @@
+"""Servidor HTTP local que imita os dois endpoints do Sysemp.
+
+Responde a POST {"pedido": ...} em `/controladoria-pedido-detalhado` e
+`/controle-andamento-crm` com dados de `dados_sinteticos`, determinísticos por
+pedido, com latência e taxa de erro configuráveis.
+
+Uso avulso:
+    python -m benchmarks.mock_sysemp --porta 3000 --latencia 0.05 --erro 0.02
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.dados_sinteticos import gerar_resposta_crm, gerar_resposta_detalhada
+
+ROTAS = {
+    '/controladoria-pedido-detalhado': gerar_resposta_detalhada,
+    '/controle-andamento-crm': gerar_resposta_crm,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_POST(self):
+        tamanho = int(self.headers.get('Content-Length', 0))
+        corpo = self.rfile.read(tamanho)
+        gerador = ROTAS.get(self.path)
+        if gerador is None:
+            return self._responder(404)
+        servidor = self.server
+        latencia = servidor.latencia + random.uniform(0, servidor.jitter)
+        if latencia:
+            time.sleep(latencia)
+        with servidor.lock:
+            servidor.requisicoes += 1
+        if random.random() < servidor.taxa_erro:
+            return self._responder(random.choice([500, 502, 503]))
+        pedido = str(json.loads(corpo)['pedido'])
+        # Mesmo pedido, mesma resposta: a semente vem do próprio ID.
+        dados = gerador(pedido, random.Random(zlib.crc32(f"{self.path}:{pedido}".encode())))
+        self._responder(200, json.dumps(dados).encode())
+
+
+class MockSysemp:
+    def __init__(self, porta=0, latencia=0.0, jitter=0.0, taxa_erro=0.0):
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', porta), _Handler)
+        self.servidor.daemon_threads = True
+        self.servidor.latencia, self.servidor.jitter, self.servidor.taxa_erro = latencia, jitter, taxa_erro
+        self.servidor.requisicoes, self.servidor.lock = 0, threading.Lock()
+        self._thread = None
+
+    @property
+    def url_base(self):
+        return f"http://127.0.0.1:{self.servidor.server_address[1]}"
+
+    @property
+    def url_detalhado(self):
+        return self.url_base + '/controladoria-pedido-detalhado'
+
+    @property
+    def url_crm(self):
+        return self.url_base + '/controle-andamento-crm'
+
+    @property
+    def requisicoes(self):
+        return self.servidor.requisicoes
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita as APIs Sysemp.")
+    parser.add_argument('--porta', type=int, default=3000)
+    parser.add_argument('--latencia', type=float, default=0.05, help="Latência fixa por requisição, em segundos.")
+    parser.add_argument('--jitter', type=float, default=0.02, help="Latência extra aleatória máxima, em segundos.")
+    parser.add_argument('--erro', type=float, default=0.0, help="Fração das requisições que devolvem 5xx.")
+    args = parser.parse_args()
+    with MockSysemp(args.porta, args.latencia, args.jitter, args.erro) as mock:
+        print(f"Mock Sysemp em {mock.url_base} (Ctrl+C para sair)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Mede o tempo de cada etapa do fluxo de auditoria em vários tamanhos de upload.
+
+    python -m benchmarks.run_benchmarks                      # 1k, 10k e 100k pedidos
+    python -m benchmarks.run_benchmarks --tamanhos 1000 10000 --json resultado.json
+    python -m benchmarks.run_benchmarks --comparar base.json  # falha se alguma etapa piorar
+
+A etapa de consulta roda contra o `MockSysemp` local; como ela é dominada pela
+latência simulada, só é medida até `--max-consulta` pedidos.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from auditoria import analisar_dados
+from benchmarks.dados_sinteticos import gerar_dataframes, gerar_ids, gerar_upload
+from benchmarks.mock_sysemp import MockSysemp
+from exportacao import crm_mais_recente_por_raw, escrever, montar_detalhado, montar_resumo
+from ingestao import ler_cabecalho, ler_coluna, preparar_base_pedidos
+from sysemp_client import consultar_pedidos
+
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000]
+TAMANHO_PAGINA = 25
+
+
+@contextmanager
+def _cronometro(resultados, etapa):
+    inicio = time.perf_counter()
+    yield
+    resultados[etapa] = time.perf_counter() - inicio
+
+
+def medir_ingestao(quantidade, resultados):
+    conteudo = gerar_upload(quantidade, 'xlsx')
+    with _cronometro(resultados, 'ingestao'):
+        colunas = ler_cabecalho(conteudo, 'upload.xlsx')
+        preparar_base_pedidos(ler_coluna(conteudo, 'upload.xlsx', colunas[1]))
+
+
+def medir_consulta(quantidade, resultados, latencia, taxa_erro, concorrencia):
+    ids = preparar_base_pedidos(pd.Series(gerar_ids(quantidade)))["ID_para_Consulta"].unique().tolist()
+    with MockSysemp(latencia=latencia, jitter=latencia / 2, taxa_erro=taxa_erro) as mock:
+        with _cronometro(resultados, 'consulta'):
+            resultado = consultar_pedidos(mock.url_detalhado, ids, {}, concorrencia_maxima=concorrencia, backoff_base=0.05)
+    resultados['consulta_falhas'] = len(resultado.ids_com_falha)
+    resultados['consulta_concorrencia_final'] = resultado.concorrencia_final
+
+
+def medir_analise(df_consolidado, df_crm, resultados):
+    with _cronometro(resultados, 'classificacao'):
+        analise = analisar_dados(df_consolidado, df_crm)
+    return analise
+
+
+def medir_detalhe(analise, resultados):
+    # O que um rerun faz ao trocar um filtro e abrir a primeira página do detalhe.
+    with _cronometro(resultados, 'detalhe'):
+        mascara = analise.mascara()
+        df_filtrado = analise.df_consolidado[mascara]
+        codigos, valores = analise.pedidos_filtrados(mascara)
+        analise.tabela_pedidos(codigos[:TAMANHO_PAGINA], valores)
+        for codigo in codigos[:TAMANHO_PAGINA]:
+            analise.linhas_sysemp(codigo, mascara)
+            analise.linhas_crm(codigo)
+    return df_filtrado
+
+
+def medir_exportacao(analise, df_filtrado, resultados):
+    with tempfile.TemporaryDirectory() as pasta:
+        with _cronometro(resultados, 'exportacao_resumo_xlsx'):
+            escrever(montar_resumo(df_filtrado, analise.categorias), 'xlsx', os.path.join(pasta, 'resumo.xlsx'), 'Resumo_por_Pedido')
+        with _cronometro(resultados, 'exportacao_detalhes_xlsx'):
+            df_export = montar_detalhado(df_filtrado, crm_mais_recente_por_raw(analise.crm), analise.categorias)
+            escrever(df_export, 'xlsx', os.path.join(pasta, 'detalhes.xlsx'), 'Detalhes_Nota_a_Nota')
+
+
+def executar(tamanhos, max_consulta, latencia, taxa_erro, concorrencia):
+    todos = {}
+    for quantidade in tamanhos:
+        resultados = {}
+        medir_ingestao(quantidade, resultados)
+        if quantidade <= max_consulta:
+            medir_consulta(quantidade, resultados, latencia, taxa_erro, concorrencia)
+        df_consolidado, df_crm = gerar_dataframes(quantidade)
+        resultados['linhas_sysemp'], resultados['linhas_crm'] = len(df_consolidado), len(df_crm)
+        analise = medir_analise(df_consolidado, df_crm, resultados)
+        df_filtrado = medir_detalhe(analise, resultados)
+        medir_exportacao(analise, df_filtrado, resultados)
+        todos[str(quantidade)] = resultados
+        print(f"\n== {quantidade} pedidos ({resultados['linhas_sysemp']} linhas Sysemp, {resultados['linhas_crm']} andamentos CRM)")
+        for etapa, valor in resultados.items():
+            if not etapa.startswith('linhas_'):
+                print(f"  {etapa:<28} {valor:>10.3f}" if isinstance(valor, float) else f"  {etapa:<28} {valor:>10}")
+    return todos
+
+
+def comparar(atual, base, tolerancia):
+    regressoes = []
+    for quantidade, etapas in atual.items():
+        for etapa, valor in etapas.items():
+            referencia = base.get(quantidade, {}).get(etapa)
+            if isinstance(valor, float) and isinstance(referencia, float) and valor > referencia * (1 + tolerancia):
+                regressoes.append(f"{quantidade} pedidos / {etapa}: {referencia:.3f}s -> {valor:.3f}s")
+    return regressoes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks das etapas da auditoria de pedidos cancelados.")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=TAMANHOS_PADRAO)
+    parser.add_argument('--max-consulta', type=int, default=10_000, help="Maior tamanho em que a consulta ao mock é medida.")
+    parser.add_argument('--latencia', type=float, default=0.01, help="Latência simulada do mock, em segundos.")
+    parser.add_argument('--erro', type=float, default=0.01, help="Taxa de erro simulada do mock.")
+    parser.add_argument('--concorrencia', type=int, default=32)
+    parser.add_argument('--json', help="Grava os tempos medidos neste arquivo.")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para detectar regressões.")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Piora relativa aceita antes de acusar regressão.")
+    args = parser.parse_args(argv)
+
+    resultados = executar(args.tamanhos, args.max_consulta, args.latencia, args.erro, args.concorrencia)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultados, arquivo, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            regressoes = comparar(resultados, json.load(arquivo), args.tolerancia)
+        if regressoes:
+            print("\nRegressões detectadas:\n  " + "\n  ".join(regressoes))
+            return 1
+        print("\nNenhuma regressão acima da tolerância.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""Configurações compartilhadas entre o app Streamlit e a execução em lote."""
+import os
+
+from sysemp_client import TIPOS_ANDAMENTO_CRM, TIPOS_PEDIDO_DETALHADO
+
+# --- Configurações de API ---
+API_PEDIDO_DETALHADO_URL = "http://209.14.71.180:3000/controladoria-pedido-detalhado"
+API_CRM_URL = "http://209.14.71.180:3000/controle-andamento-crm"
+API_CONTROLADORIA_HEADERS = {
+    'Authorization': 'Bearer engage@secure2024',
+    'Content-Type': 'application/json'
+}
+TIPOS_POR_URL = {
+    API_PEDIDO_DETALHADO_URL: TIPOS_PEDIDO_DETALHADO,
+    API_CRM_URL: TIPOS_ANDAMENTO_CRM,
+}
+
+# --- Configurações do cache local ---
+CACHE_SYSEMP_PATH = os.environ.get('SYSEMP_CACHE_PATH', os.path.join('.cache', 'sysemp_cache.sqlite'))
+CACHE_SYSEMP_TTL = {
+    API_PEDIDO_DETALHADO_URL: int(os.environ.get('SYSEMP_CACHE_TTL_DETALHADO', 12 * 3600)),
+    API_CRM_URL: int(os.environ.get('SYSEMP_CACHE_TTL_CRM', 2 * 3600)),
+}
+CACHE_SYSEMP_MAX_ENTRADAS = int(os.environ.get('SYSEMP_CACHE_MAX_ENTRADAS', 500_000))
+
+# --- Limites globais de acesso ao Sysemp (somados entre todas as sessões do app) ---
+SYSEMP_MAX_CONCORRENCIA_GLOBAL = int(os.environ.get('SYSEMP_MAX_CONCORRENCIA_GLOBAL', 32))
+SYSEMP_MAX_REQ_POR_SEGUNDO = float(os.environ.get('SYSEMP_MAX_REQ_POR_SEGUNDO', 0)) or None
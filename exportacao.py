@@ -0,0 +1,100 @@
+"""Exportação dos resultados da auditoria em xlsx, csv ou parquet.
+
+O xlsx é escrito com o modo write-only do openpyxl, em blocos de linhas: as
+linhas vão direto para o arquivo de destino e a planilha nunca é montada
+inteira em memória.
+"""
+import pandas as pd
+
+from auditoria import CATEGORIA_OK
+
+FORMATO_DATA_EXCEL = 'DD/MM/YYYY HH:MM:SS'
+FORMATO_DATA_CSV = '%d/%m/%Y %H:%M:%S'
+
+MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def formatos_disponiveis():
+    formatos = ['xlsx', 'csv']
+    try:
+        import pyarrow  # noqa: F401
+        formatos.append('parquet')
+    except ImportError:
+        pass
+    return formatos
+
+
+# --- Montagem dos DataFrames exportados ---
+def montar_resumo(df_consolidado, auditoria):
+    df_resumo = df_consolidado.groupby('pedido_normalizado').agg(
+        canal_venda=('canal_venda', 'max'), data_pedido=('data_pedido', 'max'), valor_liquido=('valor_normalizado', 'sum')
+    ).reset_index()
+    return df_resumo.assign(Auditoria=df_resumo['pedido_normalizado'].map(auditoria).fillna(CATEGORIA_OK))
+
+
+def crm_mais_recente_por_raw(crm_ordenado):
+    """Último andamento de cada `pedido_raw`, a partir do CRM já ordenado por `preparar_crm`."""
+    if crm_ordenado.empty:
+        return crm_ordenado
+    return crm_ordenado.drop_duplicates('pedido_raw', keep='first')[
+        ['pedido_raw', 'andamento_obs', 'usuario_andamento', 'datahora_andamento']].rename(columns={
+            'andamento_obs': 'Última Obs. CRM', 'usuario_andamento': 'Último Usuário CRM', 'datahora_andamento': 'Data Último And. CRM'})
+
+
+def montar_detalhado(df_consolidado, crm_recente, auditoria):
+    df_export = df_consolidado.assign(Auditoria=df_consolidado['pedido_normalizado'].map(auditoria).fillna(CATEGORIA_OK))
+    if not crm_recente.empty:
+        df_export = pd.merge(df_export, crm_recente, on='pedido_raw', how='left')
+    return df_export
+
+
+# --- Escrita ---
+def _valores_coluna(serie):
+    if isinstance(serie.dtype, pd.DatetimeTZDtype):
+        serie = serie.dt.tz_localize(None)
+    valores = serie.astype(object)
+    return valores.where(serie.notna(), None).tolist()
+
+
+def escrever_xlsx(df, destino, nome_planilha, tamanho_bloco=10_000):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet(nome_planilha)
+    planilha.append([str(coluna) for coluna in df.columns])
+    colunas_data = [i for i, dtype in enumerate(df.dtypes) if pd.api.types.is_datetime64_any_dtype(dtype)]
+
+    def celula_data(valor):
+        if valor is None:
+            return None
+        celula = WriteOnlyCell(planilha, value=valor)
+        celula.number_format = FORMATO_DATA_EXCEL
+        return celula
+
+    for inicio in range(0, len(df), tamanho_bloco):
+        bloco = df.iloc[inicio:inicio + tamanho_bloco]
+        colunas = [_valores_coluna(bloco.iloc[:, i]) for i in range(bloco.shape[1])]
+        for i in colunas_data:
+            colunas[i] = [celula_data(valor) for valor in colunas[i]]
+        for linha in zip(*colunas):
+            planilha.append(linha)
+    workbook.save(destino)
+
+
+def escrever(df, formato, destino, nome_planilha):
+    """Grava `df` em `destino` (caminho ou arquivo binário) no formato pedido."""
+    if formato == 'xlsx':
+        escrever_xlsx(df, destino, nome_planilha)
+    elif formato == 'csv':
+        # Separadores no padrão do Excel em pt-BR.
+        df.to_csv(destino, index=False, sep=';', decimal=',', date_format=FORMATO_DATA_CSV,
+                  encoding='utf-8-sig', chunksize=50_000)
+    elif formato == 'parquet':
+        df.to_parquet(destino, index=False)
+    else:
+        raise ValueError(f"Formato de exportação não suportado: {formato}")
@@ -0,0 +1,113 @@
+"""Leitura da lista de pedidos enviada pelo usuário (xlsx, xls, csv ou txt).
+
+Primeiro lê-se só o cabeçalho, para o usuário escolher a coluna dos pedidos;
+depois apenas essa coluna é percorrida. Planilhas xlsx são lidas em modo
+read-only do openpyxl, linha a linha, sem montar a planilha inteira em memória.
+"""
+import csv
+import hashlib
+import io
+
+import pandas as pd
+
+EXTENSOES_SUPORTADAS = ["xlsx", "xls", "csv", "txt"]
+COLUNA_TXT = "Pedido"
+
+
+def hash_conteudo(conteudo):
+    return hashlib.sha1(conteudo).hexdigest()
+
+
+def _extensao(nome_arquivo):
+    return nome_arquivo.rsplit('.', 1)[-1].lower() if '.' in nome_arquivo else ''
+
+
+def _nomes_colunas(valores):
+    # Mesmos nomes que o pandas daria: "Unnamed: i" para vazios e sufixo ".n" para repetidos.
+    nomes, vistos = [], {}
+    for i, valor in enumerate(valores):
+        nome = f"Unnamed: {i}" if valor is None or str(valor).strip() == '' else str(valor)
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def _texto(conteudo):
+    try:
+        return conteudo.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return conteudo.decode('latin-1')
+
+
+def _separador_csv(texto):
+    try:
+        return csv.Sniffer().sniff(texto[:64 * 1024], delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+
+def _abrir_xlsx(conteudo):
+    from openpyxl import load_workbook
+    return load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+
+
+def ler_cabecalho(conteudo, nome_arquivo):
+    extensao = _extensao(nome_arquivo)
+    if extensao == 'txt':
+        return [COLUNA_TXT]
+    if extensao == 'csv':
+        texto = _texto(conteudo)
+        return pd.read_csv(io.StringIO(texto), sep=_separador_csv(texto), nrows=0).columns.astype(str).tolist()
+    if extensao == 'xlsx':
+        workbook = _abrir_xlsx(conteudo)
+        try:
+            primeira_linha = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return _nomes_colunas(primeira_linha)
+    return pd.read_excel(io.BytesIO(conteudo), engine='xlrd', nrows=0).columns.astype(str).tolist()
+
+
+def ler_coluna(conteudo, nome_arquivo, coluna):
+    """Devolve uma Series com os valores brutos da coluna escolhida."""
+    extensao = _extensao(nome_arquivo)
+    if extensao == 'txt':
+        linhas = (linha.strip() for linha in _texto(conteudo).splitlines())
+        return pd.Series([linha for linha in linhas if linha], name=COLUNA_TXT, dtype=object)
+    if extensao == 'csv':
+        texto = _texto(conteudo)
+        df = pd.read_csv(io.StringIO(texto), sep=_separador_csv(texto), usecols=[coluna], dtype=str, keep_default_na=False, na_values=[''])
+        return df[coluna]
+    if extensao == 'xlsx':
+        indice = ler_cabecalho(conteudo, nome_arquivo).index(coluna) + 1
+        workbook = _abrir_xlsx(conteudo)
+        try:
+            linhas = workbook.worksheets[0].iter_rows(min_row=2, min_col=indice, max_col=indice, values_only=True)
+            valores = [linha[0] if linha else None for linha in linhas]
+        finally:
+            workbook.close()
+        return pd.Series(valores, name=coluna, dtype=object)
+    return pd.read_excel(io.BytesIO(conteudo), engine='xlrd', usecols=[coluna])[coluna]
+
+
+# --- Normalização dos IDs ---
+def preparar_id_para_bd(pedido_id_excel):
+    id_str = str(pedido_id_excel).replace('_CANC', '')
+    if len(id_str) == 11 and id_str.isnumeric():
+        return id_str[:-2]
+    return id_str
+
+
+def preparar_base_pedidos(valores):
+    """Monta a base de pedidos a partir dos valores brutos da coluna escolhida:
+    limpa, remove duplicados e calcula o ID usado na consulta ao Sysemp."""
+    df_base = valores.to_frame("ID Original Excel")
+    df_base.dropna(subset=["ID Original Excel"], inplace=True)
+    df_base["ID Original Excel"] = df_base["ID Original Excel"].astype(str).str.strip().str.upper().str.replace(r'\.0$', '', regex=True)
+    df_base.drop_duplicates(subset=["ID Original Excel"], inplace=True, keep='first')
+    df_base["ID_para_Consulta"] = df_base["ID Original Excel"].apply(preparar_id_para_bd)
+    return df_base
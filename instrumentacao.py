@@ -0,0 +1,136 @@
+"""Métricas de uma execução: tempo por etapa, latência por endpoint e log.
+
+Um `MetricasExecucao` é criado a cada processamento e pode ser passado para
+threads de consulta: todos os métodos são thread-safe. O log é um buffer
+circular e as latências de cada endpoint ficam numa amostra de tamanho fixo
+(reservoir sampling), então execuções longas não crescem sem limite nem deixam
+o resumo mais caro.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+MAX_LOGS_PADRAO = 500
+MAX_AMOSTRAS_LATENCIA = 10_000
+
+
+def _percentil(ordenados, fracao):
+    if not ordenados:
+        return None
+    posicao = min(len(ordenados) - 1, max(0, round(fracao * (len(ordenados) - 1))))
+    return ordenados[posicao]
+
+
+class MetricasExecucao:
+    def __init__(self, max_logs=MAX_LOGS_PADRAO, max_amostras_latencia=MAX_AMOSTRAS_LATENCIA):
+        self.inicio = datetime.now()
+        self.logs = deque(maxlen=max_logs)
+        self.max_amostras_latencia = max_amostras_latencia
+        self._lock = threading.Lock()
+        self._etapas = []
+        self._latencias = defaultdict(list)
+        self._sucessos = defaultdict(int)
+        self._latencia_max = {}
+        self._versao, self._resumo_endpoints = 0, (None, {})
+        self._erros = defaultdict(lambda: defaultdict(int))
+        self._janela = {}
+        self._contadores = defaultdict(int)
+
+    def log(self, level, message):
+        with self._lock:
+            self.logs.append({'level': level, 'content': message, 'time': datetime.now()})
+
+    def logs_recentes(self):
+        """Cópia do log, do mais recente para o mais antigo. Threads de consulta
+        podem estar escrevendo enquanto a interface lê."""
+        with self._lock:
+            return list(reversed(self.logs))
+
+    @contextmanager
+    def etapa(self, nome):
+        inicio_relogio, inicio = datetime.now(), time.perf_counter()
+        erro = None
+        try:
+            yield
+        except BaseException as e:
+            erro = type(e).__name__
+            raise
+        finally:
+            with self._lock:
+                self._etapas.append({'etapa': nome, 'inicio': inicio_relogio.isoformat(timespec='milliseconds'),
+                                     'duracao_s': round(time.perf_counter() - inicio, 4), 'erro': erro})
+
+    def registrar_requisicao(self, endpoint, latencia, erro=None):
+        agora = time.monotonic()
+        with self._lock:
+            self._versao += 1
+            if erro is None:
+                self._sucessos[endpoint] += 1
+                self._latencia_max[endpoint] = max(latencia, self._latencia_max.get(endpoint, latencia))
+                amostras = self._latencias[endpoint]
+                if len(amostras) < self.max_amostras_latencia:
+                    amostras.append(latencia)
+                else:
+                    posicao = random.randrange(self._sucessos[endpoint])
+                    if posicao < self.max_amostras_latencia:
+                        amostras[posicao] = latencia
+            else:
+                self._erros[endpoint][erro] += 1
+            primeira, _ = self._janela.get(endpoint, (agora - latencia, None))
+            self._janela[endpoint] = (primeira, agora)
+
+    def contar(self, nome, quantidade=1):
+        with self._lock:
+            self._contadores[nome] += quantidade
+
+    def resumo_endpoints(self):
+        """Percentis calculados sobre a amostra de latências; o resultado fica
+        guardado até a próxima requisição registrada."""
+        with self._lock:
+            versao, resumo = self._resumo_endpoints
+            if versao == self._versao:
+                return dict(resumo)
+            endpoints = set(self._latencias) | set(self._erros)
+            resumo = {}
+            for endpoint in sorted(endpoints):
+                latencias = sorted(self._latencias.get(endpoint, []))
+                sucessos = self._sucessos.get(endpoint, 0)
+                erros = dict(self._erros.get(endpoint, {}))
+                total = sucessos + sum(erros.values())
+                primeira, ultima = self._janela[endpoint]
+                duracao = max(ultima - primeira, 1e-9)
+                resumo[endpoint] = {
+                    'requisicoes': total,
+                    'sucessos': sucessos,
+                    'erros': sum(erros.values()),
+                    'erros_por_tipo': erros,
+                    'latencia_p50_s': _percentil(latencias, 0.50),
+                    'latencia_p90_s': _percentil(latencias, 0.90),
+                    'latencia_p99_s': _percentil(latencias, 0.99),
+                    'latencia_max_s': self._latencia_max.get(endpoint),
+                    'throughput_req_s': round(total / duracao, 2),
+                }
+            self._resumo_endpoints = (self._versao, resumo)
+            return dict(resumo)
+
+    def vazio(self):
+        with self._lock:
+            return not self.logs and not self._etapas
+
+    def resumo(self):
+        endpoints = self.resumo_endpoints()
+        with self._lock:
+            return {
+                'inicio': self.inicio.isoformat(timespec='seconds'),
+                'etapas': list(self._etapas),
+                'endpoints': endpoints,
+                'contadores': dict(self._contadores),
+                'logs': [dict(log, time=log['time'].isoformat(timespec='seconds')) for log in self.logs],
+            }
+
+    def to_json(self, resumo=None, **extras):
+        return json.dumps(dict(resumo or self.resumo(), **extras), ensure_ascii=False, indent=2)
@@ -0,0 +1,197 @@
+"""Consultas ao Sysemp em segundo plano, independentes dos reruns do Streamlit.
+
+Um `JobConsulta` roda numa thread própria e consulta os endpoints em paralelo,
+guardando a resposta de cada pedido assim que ela chega. A interface apenas lê
+o progresso e pode usar os resultados parciais a qualquer momento, cancelar o
+job ou retomá-lo (um novo job que consulta só o que ficou faltando). Os jobs
+ficam num registro do processo, então sobrevivem a reruns e ao recarregamento
+da página.
+"""
+import concurrent.futures
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from instrumentacao import MetricasExecucao
+from sysemp_cache import consultar_com_cache
+
+EXECUTANDO, CONCLUIDO, CANCELADO, ERRO = 'executando', 'concluído', 'cancelado', 'erro'
+# Jobs finalizados guardam as respostas JSON de todos os pedidos: ficam pouco tempo no registro.
+IDADE_MAXIMA_JOB = 30 * 60
+MAX_JOBS_FINALIZADOS = 8
+
+
+@dataclass
+class ProgressoEndpoint:
+    nome: str
+    url: str
+    respostas: dict = field(default_factory=dict)
+    ids_com_falha: dict = field(default_factory=dict)
+
+    @property
+    def registros(self):
+        return [registro for dados in self.respostas.values() for registro in dados]
+
+
+class JobConsulta:
+    """Consulta `ids` em cada URL de `endpoints` ({nome: url}) numa thread de fundo.
+
+    Os argumentos extras (concorrência, tentativas etc.) são repassados a
+    `consultar_com_cache`. `respostas_anteriores` ({nome: {pedido: registros}})
+    marca pedidos já respondidos, que não são consultados de novo.
+    `total_linhas` é só informativo (linhas do arquivo de origem).
+    """
+
+    def __init__(self, ids, endpoints, headers, cache=None, reconsultar_tudo=False, metricas=None,
+                 respostas_anteriores=None, total_linhas=None, **opcoes_consulta):
+        self.id = uuid.uuid4().hex
+        self.ids = list(ids)
+        self.total_linhas = len(self.ids) if total_linhas is None else total_linhas
+        self.headers = headers
+        self.cache = cache
+        self.reconsultar_tudo = reconsultar_tudo
+        self.opcoes_consulta = opcoes_consulta
+        self.metricas = metricas or MetricasExecucao()
+        respostas_anteriores = respostas_anteriores or {}
+        self.endpoints = {nome: ProgressoEndpoint(nome, url, dict(respostas_anteriores.get(nome, {})))
+                          for nome, url in endpoints.items()}
+        self.estado = EXECUTANDO
+        self.erro = None
+        self.iniciado_em = self.finalizado_em = None
+        self._ja_respondidos = sum(len(p.respostas) for p in self.endpoints.values())
+        self._cancelar = threading.Event()
+        self._lock = threading.Lock()
+
+    # --- Ciclo de vida ---
+    def iniciar(self):
+        self.iniciado_em = time.time()
+        threading.Thread(target=self._executar, name=f"job-consulta-{self.id[:8]}", daemon=True).start()
+        return self
+
+    def cancelar(self):
+        if self.ativo and not self._cancelar.is_set():
+            self._cancelar.set()
+            self.metricas.log('warning', "Cancelamento solicitado; aguardando as requisições em andamento.")
+
+    @property
+    def ativo(self):
+        return self.estado == EXECUTANDO
+
+    def _executar(self):
+        estado = ERRO
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+                for future in [executor.submit(self._consultar_endpoint, p) for p in self.endpoints.values()]:
+                    future.result()
+            estado = CANCELADO if self._cancelar.is_set() else CONCLUIDO
+        except Exception as e:
+            self.erro = f"{type(e).__name__}: {e}"
+            self.metricas.log('error', f"Consulta interrompida: {self.erro}")
+        finally:
+            # `finalizado_em` antes de `estado`: quem vê o job inativo pode contar com o horário de término.
+            self.finalizado_em = time.time()
+            self.estado = estado
+
+    def _consultar_endpoint(self, progresso):
+        ids = [pid for pid in self.ids if pid not in progresso.respostas]
+        if not ids:
+            return
+
+        def ao_receber(pedido_id, dados):
+            with self._lock:
+                progresso.respostas[pedido_id] = dados
+                progresso.ids_com_falha.pop(pedido_id, None)
+
+        def ao_falhar(pedido_id, erro):
+            with self._lock:
+                progresso.ids_com_falha[pedido_id] = erro
+
+        with self.metricas.etapa(f"consulta {progresso.nome}"):
+            resultado, acertos_cache = consultar_com_cache(
+                self.cache, progresso.url, ids, self.headers, reconsultar_tudo=self.reconsultar_tudo,
+                ao_receber=ao_receber, ao_falhar=ao_falhar, cancelar=self._cancelar,
+                metricas=self.metricas, nome_endpoint=progresso.nome, **self.opcoes_consulta)
+
+        if self.cache is not None:
+            self.metricas.log('info', f"(API {progresso.nome}) Cache local: {acertos_cache} acertos, {len(ids) - acertos_cache} consultas à rede.")
+        self.metricas.log('info', f"(API {progresso.nome}) {len(resultado.registros)} registros recebidos de {len(ids)} pedidos consultados "
+                                  f"(concorrência final: {resultado.concorrencia_final}).")
+        if resultado.ids_com_falha:
+            self.metricas.log('warning', f"(API {progresso.nome}) {len(resultado.ids_com_falha)} pedidos falharam após as novas tentativas.")
+        if resultado.ids_pendentes:
+            self.metricas.log('warning', f"(API {progresso.nome}) {len(resultado.ids_pendentes)} pedidos ficaram sem consulta pelo cancelamento.")
+
+    # --- Leitura pela interface ---
+    def progresso(self):
+        """Andamento atual: respondidos e falhas por endpoint, fração concluída e ETA em segundos."""
+        with self._lock:
+            por_endpoint = {nome: {'respondidos': len(p.respostas), 'falhas': len(p.ids_com_falha)}
+                            for nome, p in self.endpoints.items()}
+        total = len(self.ids) * len(self.endpoints)
+        feitos = sum(e['respondidos'] + e['falhas'] for e in por_endpoint.values())
+        decorrido = (self.finalizado_em or time.time()) - (self.iniciado_em or time.time())
+        eta = None
+        # A taxa considera só o que este job consultou; respostas herdadas não contam.
+        feitos_agora = feitos - self._ja_respondidos
+        if self.ativo and feitos_agora > 0 and decorrido > 0:
+            eta = (total - feitos) * decorrido / feitos_agora
+        return {'estado': self.estado, 'por_endpoint': por_endpoint, 'fracao': feitos / total if total else 1.0,
+                'decorrido_s': decorrido, 'eta_s': eta, 'erro': self.erro}
+
+    def resultados(self):
+        """Cópia dos resultados acumulados até agora, por endpoint."""
+        with self._lock:
+            return {nome: ProgressoEndpoint(p.nome, p.url, dict(p.respostas), dict(p.ids_com_falha))
+                    for nome, p in self.endpoints.items()}
+
+    def ids_restantes(self):
+        """Pedidos sem resposta em algum endpoint (não consultados ou com falha)."""
+        with self._lock:
+            return [pid for pid in self.ids if any(pid not in p.respostas for p in self.endpoints.values())]
+
+    def retomar(self):
+        """Novo job com os mesmos pedidos que reaproveita as respostas deste e consulta só o que falta."""
+        if self.ativo:
+            raise RuntimeError("O job ainda está em execução.")
+        restantes = len(self.ids_restantes())
+        novo = JobConsulta(self.ids, {nome: p.url for nome, p in self.endpoints.items()}, self.headers,
+                           cache=self.cache, reconsultar_tudo=self.reconsultar_tudo, metricas=self.metricas,
+                           respostas_anteriores={nome: p.respostas for nome, p in self.resultados().items()},
+                           total_linhas=self.total_linhas, **self.opcoes_consulta)
+        novo.metricas.log('info', f"Retomando a consulta de {restantes} pedidos restantes.")
+        return novo
+
+
+# --- Registro de jobs do processo ---
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+
+
+def _podar_jobs():
+    agora = time.time()
+    finalizados = sorted((job for job in _JOBS.values() if not job.ativo and job.finalizado_em is not None),
+                         key=lambda job: job.finalizado_em)
+    excesso = len(finalizados) - MAX_JOBS_FINALIZADOS
+    for posicao, job in enumerate(finalizados):
+        if posicao < excesso or agora - job.finalizado_em > IDADE_MAXIMA_JOB:
+            del _JOBS[job.id]
+
+
+def registrar_job(job):
+    with _JOBS_LOCK:
+        _podar_jobs()
+        _JOBS[job.id] = job
+    return job
+
+
+def obter_job(job_id):
+    with _JOBS_LOCK:
+        _podar_jobs()
+        return _JOBS.get(job_id)
+
+
+def descartar_job(job_id):
+    """Tira o job do registro (ex.: substituído por outro da mesma sessão); um job ativo segue até terminar."""
+    with _JOBS_LOCK:
+        _JOBS.pop(job_id, None)
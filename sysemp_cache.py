@@ -0,0 +1,166 @@
+"""Cache local (SQLite) das respostas das APIs Sysemp, por (endpoint, pedido).
+
+Cada endpoint tem seu próprio TTL. Respostas vazias também são guardadas, para
+que um pedido "não encontrado" não volte à rede antes de expirar; consultas
+que falharam nunca são gravadas. Quando o número de entradas passa de
+`max_entradas`, as menos acessadas recentemente são descartadas.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sysemp_client import ResultadoConsulta, consultar_pedidos
+
+TTL_PADRAO = 6 * 3600
+
+
+class CacheSysemp:
+    def __init__(self, caminho, ttl_por_endpoint=None, ttl_padrao=TTL_PADRAO, max_entradas=500_000, lote_gravacao=500):
+        self.caminho = caminho
+        self.ttl_por_endpoint = dict(ttl_por_endpoint or {})
+        self.ttl_padrao = ttl_padrao
+        self.max_entradas = max_entradas
+        self.lote_gravacao = lote_gravacao
+        self._lock = threading.Lock()
+        self._pendentes = []
+        if os.path.dirname(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("PRAGMA synchronous=NORMAL")
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS respostas (
+                endpoint TEXT NOT NULL,
+                pedido TEXT NOT NULL,
+                dados TEXT NOT NULL,
+                gravado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL,
+                PRIMARY KEY (endpoint, pedido)
+            )""")
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS ix_respostas_acesso ON respostas (acessado_em)")
+        self._conexao.execute("CREATE TABLE IF NOT EXISTS metadados (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        self._conexao.commit()
+
+    def ttl(self, endpoint):
+        return self.ttl_por_endpoint.get(endpoint, self.ttl_padrao)
+
+    def obter(self, endpoint, pedidos):
+        """Devolve {pedido: registros} apenas para as entradas ainda dentro do TTL."""
+        agora = time.time()
+        ttl = self.ttl(endpoint)
+        limite = agora - ttl if ttl is not None else float('-inf')
+        encontrados = {}
+        pedidos = [str(p) for p in pedidos]
+        with self._lock:
+            self._descarregar()
+            for i in range(0, len(pedidos), 900):
+                lote = pedidos[i:i + 900]
+                marcadores = ','.join('?' * len(lote))
+                linhas = self._conexao.execute(
+                    f"SELECT pedido, dados FROM respostas WHERE endpoint = ? AND gravado_em >= ? AND pedido IN ({marcadores})",
+                    [endpoint, limite, *lote]).fetchall()
+                encontrados.update((pedido, json.loads(dados)) for pedido, dados in linhas)
+            if encontrados:
+                self._conexao.executemany(
+                    "UPDATE respostas SET acessado_em = ? WHERE endpoint = ? AND pedido = ?",
+                    [(agora, endpoint, pedido) for pedido in encontrados])
+                self._conexao.commit()
+        return encontrados
+
+    def gravar(self, endpoint, pedido, registros):
+        agora = time.time()
+        with self._lock:
+            self._pendentes.append((endpoint, str(pedido), json.dumps(registros, default=str), agora, agora))
+            if len(self._pendentes) >= self.lote_gravacao:
+                self._descarregar()
+
+    def descarregar(self):
+        with self._lock:
+            self._descarregar()
+            self._podar()
+
+    def _descarregar(self):
+        if not self._pendentes:
+            return
+        self._conexao.executemany("INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?)", self._pendentes)
+        self._conexao.commit()
+        self._pendentes = []
+
+    def _podar(self):
+        total = self._conexao.execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+        excesso = total - self.max_entradas
+        if excesso > 0:
+            self._conexao.execute(
+                "DELETE FROM respostas WHERE rowid IN (SELECT rowid FROM respostas ORDER BY acessado_em LIMIT ?)", (excesso,))
+            self._conexao.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._descarregar()
+            self._conexao.close()
+
+    def obter_metadado(self, chave):
+        with self._lock:
+            linha = self._conexao.execute("SELECT valor FROM metadados WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else None
+
+    def gravar_metadado(self, chave, valor):
+        with self._lock:
+            self._conexao.execute("INSERT OR REPLACE INTO metadados VALUES (?, ?)", (chave, valor))
+            self._conexao.commit()
+
+    def limpar(self, endpoint=None):
+        with self._lock:
+            self._pendentes = []
+            if endpoint is None:
+                self._conexao.execute("DELETE FROM respostas")
+            else:
+                self._conexao.execute("DELETE FROM respostas WHERE endpoint = ?", (endpoint,))
+            self._conexao.commit()
+
+
+def consultar_com_cache(cache, url, lista_ids, headers, reconsultar_tudo=False, **kwargs):
+    """Consulta apenas os pedidos ausentes ou vencidos no cache e junta o resultado
+    com as respostas já guardadas. Devolve (ResultadoConsulta, acertos_cache)."""
+    # Uma reconsulta forçada também não aceita respostas recentes do consultor compartilhado.
+    kwargs.setdefault('ignorar_recentes', reconsultar_tudo)
+    if cache is None:
+        return consultar_pedidos(url, lista_ids, headers, **kwargs), 0
+
+    em_cache = {} if reconsultar_tudo else cache.obter(url, lista_ids)
+    metricas = kwargs.get('metricas')
+    if metricas:
+        nome_endpoint = kwargs.get('nome_endpoint') or url
+        metricas.contar(f"{nome_endpoint}: acertos no cache", len(em_cache))
+        metricas.contar(f"{nome_endpoint}: faltas no cache", len(lista_ids) - len(em_cache))
+    faltantes = [pid for pid in lista_ids if str(pid) not in em_cache]
+    ao_receber_original = kwargs.pop('ao_receber', None)
+
+    def ao_receber(pedido_id, dados):
+        cache.gravar(url, pedido_id, dados)
+        if ao_receber_original:
+            ao_receber_original(pedido_id, dados)
+
+    if ao_receber_original:
+        # Respostas do cache contam como recebidas já no início (progresso e resultados parciais).
+        for pid in lista_ids:
+            if str(pid) in em_cache:
+                ao_receber_original(pid, em_cache[str(pid)])
+
+    try:
+        resultado = consultar_pedidos(url, faltantes, headers, ao_receber=ao_receber, **kwargs) if faltantes else ResultadoConsulta()
+    finally:
+        cache.descarregar()
+
+    for pid in lista_ids:
+        dados = em_cache.get(str(pid))
+        if dados is None:
+            continue
+        if dados:
+            resultado.registros.extend(dados)
+            resultado.ids_encontrados.append(pid)
+        else:
+            resultado.ids_nao_encontrados.append(pid)
+    return resultado, len(em_cache)
@@ -0,0 +1,329 @@
+"""Cliente das APIs Sysemp (pedido detalhado e andamento CRM).
+
+Consulta os pedidos em paralelo reaproveitando conexões keep-alive, ajusta a
+concorrência de acordo com a latência observada e refaz as requisições que
+falham por motivo transitório. Pedidos sem retorno na base ("não encontrados")
+são separados dos pedidos cuja consulta falhou de vez. Um
+`ConsultorCompartilhado` opcional concentra as requisições de todas as sessões
+do processo num único pool, com limites globais e sem chamadas duplicadas.
+"""
+import contextlib
+import random
+import threading
+import time
+import concurrent.futures
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+STATUS_TRANSITORIOS = {408, 425, 429, 500, 502, 503, 504}
+
+# --- Tipos das colunas retornadas por cada endpoint ---
+# Colunas de baixa cardinalidade viram categorias (ordenadas, para que max/min e
+# ordenação continuem lexicográficos); valores e datas já chegam convertidos.
+TIPOS_PEDIDO_DETALHADO = {
+    'categoricas': ['canal_venda', 'id_empresa', 'transportadora', 'motivo_bloqueio', 'validacao_pedido', 'bloqueada', 'nfe_cstat'],
+    'numericas': ['valor_normalizado'],
+    'datas': [],
+}
+TIPOS_ANDAMENTO_CRM = {
+    'categoricas': ['andamento_descricao'],
+    'numericas': [],
+    'datas': ['datahora_andamento'],
+}
+
+
+@dataclass
+class ResultadoConsulta:
+    registros: list = field(default_factory=list)
+    ids_encontrados: list = field(default_factory=list)
+    ids_nao_encontrados: list = field(default_factory=list)
+    ids_com_falha: dict = field(default_factory=dict)
+    ids_pendentes: list = field(default_factory=list)
+    concorrencia_final: int = 0
+
+
+class FalhaConsulta(Exception):
+    def __init__(self, mensagem, transitoria, tipo=None):
+        super().__init__(mensagem)
+        self.transitoria = transitoria
+        self.tipo = tipo or mensagem
+
+
+def registros_para_dataframe(registros, tipos=None):
+    """Monta o DataFrame de uma lista de registros JSON já com as colunas tipadas."""
+    df = pd.DataFrame.from_records(registros) if registros else pd.DataFrame()
+    if df.empty or not tipos:
+        return df
+    for coluna in tipos.get('numericas', []):
+        if coluna in df.columns:
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0)
+    for coluna in tipos.get('datas', []):
+        if coluna in df.columns:
+            df[coluna] = pd.to_datetime(df[coluna], errors='coerce')
+    for coluna in tipos.get('categoricas', []):
+        if coluna in df.columns:
+            try:
+                df[coluna] = pd.Categorical(df[coluna], ordered=True)
+            except TypeError:
+                # Valores não ordenáveis entre si (ex.: números e textos misturados).
+                df[coluna] = df[coluna].astype('category')
+    return df
+
+
+# --- Controle adaptativo de concorrência ---
+class LimiteAdaptativo:
+    """AIMD guiado por latência: sobe um slot por janela enquanto a latência
+    recente se mantém perto da melhor observada e recua multiplicativamente
+    quando ela degrada ou quando o servidor sinaliza sobrecarga."""
+
+    def __init__(self, inicial=2, minimo=1, maximo=32, janela=None, tolerancia=1.5, recuo=0.7):
+        self.limite = max(minimo, min(inicial, maximo))
+        self.minimo, self.maximo = minimo, maximo
+        self.janela, self.tolerancia, self.recuo = janela, tolerancia, recuo
+        self._lock = threading.Lock()
+        self._latencia_base = None
+        self._amostras, self._sobrecargas = [], 0
+
+    def registrar(self, latencia, sobrecarga=False):
+        with self._lock:
+            # Sinais de sobrecarga também preenchem a janela: se tudo falhar, o limite continua recuando.
+            if sobrecarga:
+                self._sobrecargas += 1
+            else:
+                self._amostras.append(latencia)
+            if len(self._amostras) + self._sobrecargas < (self.janela or self.limite):
+                return
+            self._ajustar()
+
+    def _ajustar(self):
+        if self._sobrecargas:
+            self.limite = max(self.minimo, int(self.limite * self.recuo))
+        elif self._amostras:
+            amostras = sorted(self._amostras)
+            mediana = amostras[len(amostras) // 2]
+            if self._latencia_base is None or mediana < self._latencia_base:
+                self._latencia_base = mediana
+            if mediana <= self._latencia_base * self.tolerancia:
+                self.limite = min(self.maximo, self.limite + 1)
+            else:
+                self.limite = max(self.minimo, int(self.limite * self.recuo))
+                # Deixa a linha de base acompanhar mudanças duradouras no servidor.
+                self._latencia_base = (self._latencia_base + mediana) / 2
+        self._amostras, self._sobrecargas = [], 0
+
+
+# --- Sessão HTTP ---
+def criar_sessao(tamanho_pool):
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool, pool_block=True)
+    sessao.mount('http://', adaptador)
+    sessao.mount('https://', adaptador)
+    return sessao
+
+
+# --- Camada compartilhada entre sessões ---
+class LimiteTaxa:
+    """Limita a taxa de requisições (GCRA): no máximo `por_segundo`, com rajadas de até `rajada`."""
+
+    def __init__(self, por_segundo, rajada=1):
+        self.intervalo = 1.0 / por_segundo
+        self.tolerancia = self.intervalo * (max(1, rajada) - 1)
+        self._lock = threading.Lock()
+        self._proxima = 0.0
+
+    def aguardar(self):
+        with self._lock:
+            agora = time.monotonic()
+            self._proxima = max(self._proxima, agora)
+            espera = self._proxima - agora - self.tolerancia
+            self._proxima += self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+class ConsultorCompartilhado:
+    """Ponto único de saída para o Sysemp dentro do processo.
+
+    Todas as sessões (e jobs) usam o mesmo pool de conexões e respeitam o mesmo
+    limite de requisições simultâneas e por segundo. Requisições idênticas
+    (mesma URL e pedido) que chegam enquanto outra está em voo não vão à rede:
+    esperam e recebem a mesma resposta (ou a mesma falha). Respostas com menos
+    de `janela_reuso` segundos também são reaproveitadas, para sessões que
+    chegam logo depois de outra ter consultado os mesmos pedidos.
+    """
+
+    def __init__(self, max_concorrencia=32, max_por_segundo=None, rajada=None, janela_reuso=30.0, max_recentes=50_000):
+        self.max_concorrencia = max_concorrencia
+        self.sessao = criar_sessao(max_concorrencia)
+        self._vagas = threading.BoundedSemaphore(max_concorrencia)
+        self._taxa = LimiteTaxa(max_por_segundo, rajada or max_concorrencia) if max_por_segundo else None
+        self.janela_reuso, self.max_recentes = janela_reuso, max_recentes
+        self._lock = threading.Lock()
+        self._em_voo = {}
+        self._recentes = OrderedDict()
+        self._contadores = {'requisicoes': 0, 'compartilhadas': 0}
+
+    def post(self, url, headers, pedido_id, timeout, ignorar_recentes=False):
+        """Devolve (registros, compartilhada); `compartilhada` indica que outra chamada fez a requisição.
+        Com `ignorar_recentes` (reconsulta forçada), só uma requisição ainda em voo é reaproveitada."""
+        chave = (url, str(pedido_id))
+        with self._lock:
+            recente = None if ignorar_recentes else self._recentes.get(chave)
+            if recente is not None and time.monotonic() - recente[0] <= self.janela_reuso:
+                self._contadores['compartilhadas'] += 1
+                return recente[1], True
+            future = self._em_voo.get(chave)
+            lider = future is None
+            if lider:
+                future = self._em_voo[chave] = concurrent.futures.Future()
+                self._contadores['requisicoes'] += 1
+            else:
+                self._contadores['compartilhadas'] += 1
+        if lider:
+            try:
+                # A espera pela taxa acontece fora do semáforo, para não prender vagas em `sleep`.
+                if self._taxa:
+                    self._taxa.aguardar()
+                with self._vagas:
+                    dados = _post_pedido(self.sessao, url, headers, pedido_id, timeout)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                self._guardar_recente(chave, dados)
+                future.set_result(dados)
+            finally:
+                with self._lock:
+                    del self._em_voo[chave]
+        return future.result(), not lider
+
+    def _guardar_recente(self, chave, dados):
+        agora = time.monotonic()
+        with self._lock:
+            self._recentes[chave] = (agora, dados)
+            self._recentes.move_to_end(chave)
+            while self._recentes:
+                instante, _ = next(iter(self._recentes.values()))
+                if len(self._recentes) <= self.max_recentes and agora - instante <= self.janela_reuso:
+                    break
+                self._recentes.popitem(last=False)
+
+    def estatisticas(self):
+        with self._lock:
+            return dict(self._contadores, em_voo=len(self._em_voo), recentes=len(self._recentes))
+
+
+def _espera_backoff(tentativa, base, teto):
+    # "Full jitter": espalha as novas tentativas para não sincronizar rajadas.
+    return random.uniform(0, min(teto, base * (2 ** tentativa)))
+
+
+def _post_pedido(sessao, url, headers, pedido_id, timeout):
+    try:
+        response = sessao.post(url, headers=headers, json={"pedido": pedido_id}, timeout=timeout)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise FalhaConsulta(f"{type(e).__name__}: {e}", transitoria=True, tipo=type(e).__name__) from e
+    except requests.exceptions.RequestException as e:
+        raise FalhaConsulta(f"{type(e).__name__}: {e}", transitoria=False, tipo=type(e).__name__) from e
+    if response.status_code >= 400:
+        raise FalhaConsulta(f"HTTP {response.status_code}", transitoria=response.status_code in STATUS_TRANSITORIOS)
+    try:
+        dados = response.json()
+    except ValueError as e:
+        raise FalhaConsulta(f"Resposta inválida: {e}", transitoria=False, tipo="Resposta inválida") from e
+    if dados is None:
+        return []
+    return [dados] if isinstance(dados, dict) else list(dados)
+
+
+def consultar_pedidos(url, lista_ids, headers, concorrencia_inicial=2, concorrencia_maxima=32,
+                      tentativas=4, timeout=30, backoff_base=0.5, backoff_teto=10.0, ao_receber=None,
+                      ao_falhar=None, cancelar=None, metricas=None, nome_endpoint=None, consultor=None,
+                      ignorar_recentes=False):
+    """Consulta cada pedido de `lista_ids` em `url`.
+
+    `ao_receber(pedido_id, registros)` é chamado a cada pedido respondido com
+    sucesso (lista vazia quando o pedido não existe no Sysemp) e
+    `ao_falhar(pedido_id, erro)` a cada pedido que falhou de vez. Quando o
+    `threading.Event` `cancelar` é acionado, nenhum pedido novo é enviado; os
+    que estavam em andamento terminam e os demais voltam em `ids_pendentes`.
+    Se `metricas` (um `MetricasExecucao`) for informado, cada tentativa é
+    registrada com sua latência sob `nome_endpoint`. Com um
+    `ConsultorCompartilhado`, as requisições passam pelo pool e pelos limites
+    do processo e respostas já em voo para outra sessão são reaproveitadas
+    (as recém-recebidas também, a menos que `ignorar_recentes`).
+    """
+    resultado = ResultadoConsulta()
+    if not lista_ids:
+        return resultado
+
+    limite = LimiteAdaptativo(inicial=concorrencia_inicial, maximo=concorrencia_maxima)
+    nome_endpoint = nome_endpoint or url
+
+    def fetch_single(pedido_id, sessao):
+        for tentativa in range(tentativas):
+            inicio = time.monotonic()
+            try:
+                if consultor is None:
+                    dados, compartilhada = _post_pedido(sessao, url, headers, pedido_id, timeout), False
+                else:
+                    dados, compartilhada = consultor.post(url, headers, pedido_id, timeout, ignorar_recentes)
+            except FalhaConsulta as e:
+                latencia = time.monotonic() - inicio
+                limite.registrar(latencia, sobrecarga=e.transitoria)
+                if metricas:
+                    metricas.registrar_requisicao(nome_endpoint, latencia, erro=e.tipo)
+                if not e.transitoria or tentativa == tentativas - 1:
+                    raise
+                if metricas:
+                    metricas.contar(f"{nome_endpoint}: novas tentativas")
+                time.sleep(_espera_backoff(tentativa, backoff_base, backoff_teto))
+            else:
+                latencia = time.monotonic() - inicio
+                limite.registrar(latencia)
+                if metricas and compartilhada:
+                    metricas.contar(f"{nome_endpoint}: respostas compartilhadas")
+                elif metricas:
+                    metricas.registrar_requisicao(nome_endpoint, latencia)
+                return dados
+
+    pendentes = iter(lista_ids)
+    em_andamento = {}
+    with (criar_sessao(concorrencia_maxima) if consultor is None else contextlib.nullcontext()) as sessao, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=concorrencia_maxima) as executor:
+        esgotado = False
+        while True:
+            if cancelar is not None and cancelar.is_set() and not esgotado:
+                resultado.ids_pendentes.extend(pendentes)
+                esgotado = True
+            while not esgotado and len(em_andamento) < limite.limite:
+                pedido_id = next(pendentes, None)
+                if pedido_id is None:
+                    esgotado = True
+                    break
+                em_andamento[executor.submit(fetch_single, pedido_id, sessao)] = pedido_id
+            if not em_andamento:
+                break
+            concluidos, _ = concurrent.futures.wait(em_andamento, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in concluidos:
+                pedido_id = em_andamento.pop(future)
+                try:
+                    dados = future.result()
+                except FalhaConsulta as e:
+                    resultado.ids_com_falha[pedido_id] = str(e)
+                    if ao_falhar:
+                        ao_falhar(pedido_id, str(e))
+                    continue
+                if dados:
+                    resultado.registros.extend(dados)
+                    resultado.ids_encontrados.append(pedido_id)
+                else:
+                    resultado.ids_nao_encontrados.append(pedido_id)
+                if ao_receber:
+                    ao_receber(pedido_id, dados)
+
+    resultado.concorrencia_final = limite.limite
+    return resultado
@@ -0,0 +1,102 @@
+"""Regras de classificação da auditoria: uma regra por pedido e a ordem de prioridade."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from auditoria import (CAT_BLOQUEADO_SEM_FATURAMENTO, CAT_CANCELAMENTO_PENDENTE, CAT_CARTA_DEBITO, CAT_COBRANCA_ATIVA,
+                       CAT_DEVOLVIDO, CAT_FATURAMENTO_CANCELADO, CAT_FINALIZADO, CAT_OUTRAS_TRATATIVAS,
+                       CAT_PENDENTE_TRATATIVA, CATEGORIA_OK, CATEGORIAS_AUDITORIA, analisar_dados, classificar_pedidos,
+                       remover_pedidos)
+from benchmarks.dados_sinteticos import gerar_dataframes
+from sysemp_client import TIPOS_ANDAMENTO_CRM, TIPOS_PEDIDO_DETALHADO, registros_para_dataframe
+
+
+def _nota(pedido, valor=100.0, cstat='100', raw=None):
+    return {'pedido_normalizado': pedido, 'pedido_raw': raw or pedido, 'valor_normalizado': valor,
+            'validacao_pedido': 'Nota', 'nfe_cstat': cstat, 'bloqueada': 'F', 'canal_venda': 'SITE'}
+
+
+def _so_pedido(pedido, bloqueada='F', valor=100.0):
+    return dict(_nota(pedido, valor), validacao_pedido='Pedido', nfe_cstat=None, bloqueada=bloqueada)
+
+
+def _andamento(pedido, descricao, obs='', data='2024-01-10 10:00:00', raw=None):
+    return {'pedido_normalizado': pedido, 'pedido_raw': raw or pedido, 'andamento_descricao': descricao,
+            'andamento_obs': obs, 'datahora_andamento': data}
+
+
+# Cada pedido satisfaz a regra da categoria esperada; vários também satisfazem regras de menor prioridade.
+CASOS = {
+    'P01': ([_so_pedido('P01', bloqueada='T')], [_andamento('P01', 'EM ANÁLISE', 'LIBERADO PARA CANCELAMENTO')],
+            CAT_CANCELAMENTO_PENDENTE),
+    'P02': ([_so_pedido('P02', bloqueada='T')], [], CAT_BLOQUEADO_SEM_FATURAMENTO),
+    'P03': ([_nota('P03', cstat='101'), _nota('P03', raw='P03_CANC')], [_andamento('P03', 'FINALIZADO')],
+            CAT_FATURAMENTO_CANCELADO),
+    'P04': ([_nota('P04', valor=0.5)], [_andamento('P04', 'FINALIZADO')], CAT_DEVOLVIDO),
+    'P05': ([_nota('P05')], [_andamento('P05', 'FINALIZADO', 'CARTA DE DÉBITO ENVIADA')], CAT_CARTA_DEBITO),
+    'P06': ([_nota('P06')], [_andamento('P06', 'COBRANÇA', data='2024-01-01 08:00:00'), _andamento('P06', 'FINALIZADO')],
+            CAT_FINALIZADO),
+    'P07': ([_nota('P07')], [_andamento('P07', 'JURÍDICO')], CAT_COBRANCA_ATIVA),
+    'P08': ([_nota('P08')], [_andamento('P08', 'EM ANÁLISE')], CAT_OUTRAS_TRATATIVAS),
+    'P09': ([_nota('P09')], [_andamento('P09', 'EM EXPEDIÇÃO')], CAT_PENDENTE_TRATATIVA),
+    'P10': ([_nota('P10')], [], CAT_PENDENTE_TRATATIVA),
+    'P11': ([_so_pedido('P11')], [], CAT_PENDENTE_TRATATIVA),
+    'P12': ([_so_pedido('P12', valor=0.0)], [], CATEGORIA_OK),
+    'P13': ([_nota('P13', valor=-50.0)], [_andamento('P13', 'EM EXPEDIÇÃO')], CATEGORIA_OK),
+}
+
+
+def _frames(tipado):
+    sysemp = [linha for linhas, _, _ in CASOS.values() for linha in linhas]
+    crm = [linha for _, linhas, _ in CASOS.values() for linha in linhas]
+    if tipado:
+        return registros_para_dataframe(sysemp, TIPOS_PEDIDO_DETALHADO), registros_para_dataframe(crm, TIPOS_ANDAMENTO_CRM)
+    return pd.DataFrame(sysemp), pd.DataFrame(crm)
+
+
+def test_ordem_de_prioridade():
+    assert CATEGORIAS_AUDITORIA == [
+        CAT_CANCELAMENTO_PENDENTE, CAT_BLOQUEADO_SEM_FATURAMENTO, CAT_FATURAMENTO_CANCELADO, CAT_DEVOLVIDO,
+        CAT_CARTA_DEBITO, CAT_FINALIZADO, CAT_COBRANCA_ATIVA, CAT_OUTRAS_TRATATIVAS, CAT_PENDENTE_TRATATIVA,
+    ]
+
+
+@pytest.mark.parametrize('tipado', [False, True], ids=['bruto', 'tipado'])
+def test_cada_regra(tipado):
+    df_consolidado, df_crm = _frames(tipado)
+    categorias = classificar_pedidos(df_consolidado, df_crm)
+    assert categorias.to_dict() == {pedido: esperado for pedido, (_, _, esperado) in CASOS.items()}
+
+
+def test_sem_crm_nenhum_pedido_fica_pendente_de_tratativa():
+    df_consolidado, _ = _frames(tipado=False)
+    categorias = classificar_pedidos(df_consolidado, pd.DataFrame())
+    assert CAT_PENDENTE_TRATATIVA not in set(categorias)
+    assert categorias['P02'] == CAT_BLOQUEADO_SEM_FATURAMENTO
+
+
+def test_analise_conta_as_mesmas_categorias():
+    df_consolidado, df_crm = _frames(tipado=True)
+    analise = analisar_dados(df_consolidado, df_crm)
+    assert analise.contagens.to_dict() == pd.Series([esperado for _, _, esperado in CASOS.values()]).value_counts().to_dict()
+
+
+def test_pedidos_removidos_nao_sao_classificados():
+    df_consolidado, df_crm = _frames(tipado=False)
+    categorias = classificar_pedidos(remover_pedidos(df_consolidado, {'P08', 'P09'}), df_crm)
+    assert 'P08' not in categorias.index and 'P09' not in categorias.index
+    assert len(categorias) == len(CASOS) - 2
+
+
+def test_resumo_filtrado_igual_ao_agrupamento_das_linhas():
+    analise = analisar_dados(*gerar_dataframes(300))
+    canal = analise.opcoes_filtros['canal_venda'][0]
+    for mascara in (analise.mascara(), analise.mascara(canal_venda=canal), analise.mascara(categoria=CATEGORIA_OK)):
+        esperado = analise.df_consolidado[mascara].groupby('pedido_normalizado').agg(
+            canal_venda=('canal_venda', 'first'), data_pedido=('data_pedido', 'first'), valor_liquido=('valor_normalizado', 'sum')
+        ).reset_index()
+        codigos, valores = analise.pedidos_filtrados(mascara)
+        obtido = analise.tabela_pedidos(codigos, valores).reset_index(drop=True)
+        assert obtido['pedido_normalizado'].tolist() == esperado['pedido_normalizado'].tolist()
+        assert obtido['canal_venda'].astype(object).tolist() == esperado['canal_venda'].astype(object).tolist()
+        np.testing.assert_allclose(obtido['valor_liquido'], esperado['valor_liquido'])
@@ -0,0 +1,67 @@
+"""Jobs de consulta em segundo plano contra o mock local do Sysemp."""
+import time
+
+import pytest
+
+from benchmarks.mock_sysemp import MockSysemp
+from instrumentacao import MetricasExecucao
+from jobs_consulta import CANCELADO, CONCLUIDO, JobConsulta
+from sysemp_cache import CacheSysemp
+
+IDS = [str(100000000 + i * 7) for i in range(200)]
+
+
+@pytest.fixture
+def mock():
+    with MockSysemp(latencia=0.01) as servidor:
+        yield servidor
+
+
+def _endpoints(mock):
+    return {'Sysemp-Detalhado': mock.url_detalhado, 'Sysemp-CRM': mock.url_crm}
+
+
+def _esperar(job, timeout=30):
+    limite = time.monotonic() + timeout
+    while job.ativo and time.monotonic() < limite:
+        time.sleep(0.02)
+    assert not job.ativo
+
+
+def _acertos_cache(metricas):
+    return sum(total for nome, total in metricas.resumo()['contadores'].items() if nome.endswith('acertos no cache'))
+
+
+def test_cancelar_e_retomar_completa_todos_os_pedidos(mock):
+    job = JobConsulta(IDS, _endpoints(mock), {}, concorrencia_maxima=2).iniciar()
+    time.sleep(0.2)
+    job.cancelar()
+    _esperar(job)
+    assert job.estado == CANCELADO and job.ids_restantes()
+
+    retomado = job.retomar().iniciar()
+    _esperar(retomado)
+    assert retomado.estado == CONCLUIDO
+    assert retomado.ids_restantes() == []
+    assert all(len(p.respostas) == len(IDS) for p in retomado.resultados().values())
+
+
+def test_retomar_reconsulta_tudo_mantem_o_cache_ignorado(mock, tmp_path):
+    cache = CacheSysemp(str(tmp_path / 'cache.sqlite'))
+    _esperar(JobConsulta(IDS, _endpoints(mock), {}, cache=cache).iniciar())
+    requisicoes_antes = mock.requisicoes
+
+    metricas = MetricasExecucao()
+    job = JobConsulta(IDS, _endpoints(mock), {}, cache=cache, reconsultar_tudo=True, metricas=metricas,
+                      concorrencia_maxima=2).iniciar()
+    time.sleep(0.2)
+    job.cancelar()
+    _esperar(job)
+    assert job.ids_restantes()
+
+    retomado = job.retomar()
+    assert retomado.reconsultar_tudo
+    _esperar(retomado.iniciar())
+    assert retomado.ids_restantes() == []
+    assert _acertos_cache(metricas) == 0
+    assert mock.requisicoes - requisicoes_antes == 2 * len(IDS)
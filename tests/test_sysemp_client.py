@@ -0,0 +1,56 @@
+"""Controle adaptativo de concorrência e consultor compartilhado do cliente Sysemp."""
+from benchmarks.mock_sysemp import MockSysemp
+from sysemp_client import ConsultorCompartilhado, LimiteAdaptativo, consultar_pedidos
+
+
+def _subir(limite, quantidade, latencia=0.01):
+    for _ in range(quantidade):
+        limite.registrar(latencia)
+
+
+def test_sobe_enquanto_a_latencia_se_mantem():
+    limite = LimiteAdaptativo(inicial=2, maximo=32)
+    _subir(limite, 40)
+    assert limite.limite > 2
+
+
+def test_recua_quando_todas_as_requisicoes_sinalizam_sobrecarga():
+    limite = LimiteAdaptativo(inicial=2, maximo=32)
+    _subir(limite, 40)
+    pico = limite.limite
+    for _ in range(pico):
+        limite.registrar(0.01, sobrecarga=True)
+    assert limite.limite < pico
+    for _ in range(1000):
+        limite.registrar(0.01, sobrecarga=True)
+    assert limite.limite == limite.minimo
+
+
+def test_uma_sobrecarga_na_janela_basta_para_recuar():
+    limite = LimiteAdaptativo(inicial=10, maximo=32, janela=10)
+    for _ in range(9):
+        limite.registrar(0.01)
+    limite.registrar(0.01, sobrecarga=True)
+    assert limite.limite == 7
+
+
+def test_recua_quando_a_latencia_degrada():
+    limite = LimiteAdaptativo(inicial=8, maximo=32, janela=8)
+    _subir(limite, 8, latencia=0.01)
+    assert limite.limite == 9
+    _subir(limite, 8, latencia=0.1)
+    assert limite.limite == 6
+
+
+def test_consultor_reaproveita_recentes_exceto_em_reconsulta_forcada():
+    ids = [str(100000000 + i) for i in range(30)]
+    with MockSysemp(latencia=0.005) as mock:
+        consultor = ConsultorCompartilhado(max_concorrencia=4)
+        consultar_pedidos(mock.url_crm, ids, {}, consultor=consultor)
+        assert mock.requisicoes == len(ids)
+        consultar_pedidos(mock.url_crm, ids, {}, consultor=consultor)
+        assert mock.requisicoes == len(ids)
+        consultar_pedidos(mock.url_crm, ids, {}, consultor=consultor, ignorar_recentes=True)
+        assert mock.requisicoes == 2 * len(ids)
+    assert consultor.estatisticas()['requisicoes'] == 2 * len(ids)
+    assert consultor.estatisticas()['compartilhadas'] == len(ids)